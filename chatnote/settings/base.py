@@ -132,3 +132,14 @@ GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 
 SLACK_CLIENT_ID = os.getenv("SLACK_CLIENT_ID")
 SLACK_CLIENT_SECRET = os.getenv("SLACK_CLIENT_SECRET")
+
+# notion raw block 보관 위치. file:///path 또는 s3://bucket/prefix, 비어 있으면 보관하지 않는다
+NOTION_ARCHIVE_URL = os.getenv("NOTION_ARCHIVE_URL")
+NOTION_ARCHIVE_S3_ENDPOINT_URL = os.getenv("NOTION_ARCHIVE_S3_ENDPOINT_URL")
+
+# chunk embedding 을 만드는 provider. openai 또는 onnx (EMBEDDING_ONNX_MODEL_DIR 의 model.onnx, tokenizer.json 사용)
+# provider 를 바꾸면 EMBEDDING_DIMS 가 다른 새 chunk index 로 다시 index 해야 한다
+# onnx 는 requirements-onnx.in 의 onnxruntime, tokenizers 가 설치되어 있어야 한다
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_ONNX_MODEL_DIR = os.getenv("EMBEDDING_ONNX_MODEL_DIR")
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", 1536))
@@ -3,10 +3,7 @@ from typing import List, Union
 
 import openai
 import tiktoken
-from django.db.models import When, Case, F
 from langchain.callbacks import get_openai_callback
-from langchain.chat_models import ChatOpenAI
-from langchain.llms import OpenAI
 from langchain.output_parsers import PydanticOutputParser, CommaSeparatedListOutputParser
 from langchain.prompts import PromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate
 from langchain.schema import AIMessage, StrOutputParser, HumanMessage, SystemMessage
@@ -17,7 +14,10 @@ from chats.prompts import SUGGESTED_QUESTIONS_AFTER_ANSWER_INSTRUCTION_PROMPT, C
     CHAT_GENERATE_WITH_CONTEXT_SYSTEM_PROMPT, IS_PRIVATE_PROMPT, CHAT_GENERATE_SYSTEM_PROMPT, \
     ABLE_TO_KNOW_INTENT_QUERY_PROMPT, CHAT_GENERATE_WITH_NO_CONTEXT_SYSTEM_PROMPT
 from chats.schemas import SearchResponseSchema
-from cores.elastics.clients import ChunkedContextClient
+from cores.caches import query_embedding_cache
+from cores.constants import RETRIEVAL_MODE
+from cores.elastics.clients import ChunkedContextClient, HybridContextClient
+from cores.llms.openais import get_chat_model
 from cores.utils import print_token_summary, print_execution_time
 from sources.enums import DataSourceEnum
 
@@ -34,8 +34,8 @@ def get_num_tokens_from_text(text: str, encoding_name: str = "cl100k_base") -> i
 
 class ChatService:
     def __init__(self):
-        self.model_gpt35_turbo = ChatOpenAI(temperature=0.1)
-        self.model_gpt35_turbo_16k = ChatOpenAI(model_name="gpt-3.5-turbo-16k", temperature=0.1)
+        self.model_gpt35_turbo = get_chat_model("gpt-3.5-turbo")
+        self.model_gpt35_turbo_16k = get_chat_model("gpt-3.5-turbo-16k")
 
     @print_token_summary
     @print_execution_time
@@ -150,43 +150,59 @@ class ChatService:
 
 
 class RetrievalService:
-    def __init__(self, user):
+    def __init__(self, user, retrieval_mode: str = RETRIEVAL_MODE):
         self.user = user
+        self.retrieval_mode = retrieval_mode
         self.chunked_client = ChunkedContextClient()
-        self.model = OpenAI(temperature=0)
-
-    def search(self, query: str) -> List[SearchResponseSchema]:
-        chunked_documents = self.chunked_client.similarity_search(query, self.user.id)
-        search_response_schemas = []
-        document_urls = []
-        chunked_texts = []
+        self.hybrid_client = HybridContextClient()
 
-        for document in chunked_documents:
-            if document.metadata["data_source_type"] == DataSourceEnum.notion:
-                document_url = document.metadata["url"]
-
-                if document_url in document_urls:
-                    for idx, exist_url in enumerate(document_urls):
-                        if document_url == exist_url:
-                            chunked_texts[idx] = chunked_texts[idx] + f" {document.page_content}"
-                else:
-                    document_urls.append(document_url)
-                    chunked_texts.append(document.page_content)
+    def search(self, query: str, query_vector: List[float] = None) -> List[SearchResponseSchema]:
+        if self.retrieval_mode == "hybrid":
+            url_2_chunked_text = self.hybrid_search(query, query_vector)
+        else:
+            url_2_chunked_text = self.vector_search(query, query_vector)
+        query_embedding_cache.print_summary()
 
-        if document_urls:
-            ordering = Case(*[When(url=_url, then=_idx) for _idx, _url in enumerate(document_urls)])
-            for i, item in enumerate(self.user.originaldocument_set.filter(url__in=document_urls).order_by(ordering)):
-                if item.source == DataSourceEnum.notion:
+        search_response_schemas = []
+        if url_2_chunked_text:
+            url_2_original_document = {
+                item.url: item for item in self.user.originaldocument_set.filter(url__in=url_2_chunked_text.keys())
+            }
+            for document_url, chunked_text in url_2_chunked_text.items():
+                item = url_2_original_document.get(document_url)
+                if item and item.source == DataSourceEnum.notion:
                     search_response_schemas.append(SearchResponseSchema(
                         title=item.title,
                         original_document_id=item.id,
                         original_text=item.text,
-                        chunked_text=chunked_texts[i],
+                        chunked_text=chunked_text,
                         url=item.url,
                         source=DataSourceEnum.notion
                     ))
         return search_response_schemas
 
+    @print_execution_time
+    def vector_search(self, query: str, query_vector: List[float] = None) -> dict:
+        # {url: 같은 url 의 chunk text 를 이어 붙인 text}, 검색 순서 유지
+        chunked_documents = self.chunked_client.similarity_search(query, self.user.id, query_vector)
+        url_2_chunked_text = {}
+        for document in chunked_documents:
+            if document.metadata["data_source_type"] == DataSourceEnum.notion:
+                document_url = document.metadata["url"]
+                if document_url in url_2_chunked_text:
+                    url_2_chunked_text[document_url] = url_2_chunked_text[document_url] + f" {document.page_content}"
+                else:
+                    url_2_chunked_text[document_url] = document.page_content
+        return url_2_chunked_text
+
+    @print_execution_time
+    def hybrid_search(self, query: str, query_vector: List[float] = None) -> dict:
+        results = self.hybrid_client.search(query, self.user.id, query_vector)
+        return {
+            result["url"]: result["chunked_text"] for result in results
+            if result["data_source_type"] == DataSourceEnum.notion
+        }
+
     def create_session(self):
         session = ChatSession.objects.create(user=self.user)
         return session
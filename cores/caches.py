@@ -0,0 +1,184 @@
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from typing import List, Callable
+
+from django.utils import timezone
+
+from cores.constants import QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_USE_DB, EMBEDDING_CACHE_TTL_DAYS, \
+    EMBEDDING_CACHE_TOUCH_DAYS, EMBEDDING_CACHE_PRUNE_BATCH_SIZE
+from cores.models import EmbeddingCache
+
+
+class EmbeddingCacheStore:
+    """
+    (model, sha256(text)) -> vector. 없는 text 만 embed_func 로 embedding 하고 저장한다
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def get_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @staticmethod
+    def pack(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def unpack(packed_vector: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(bytes(packed_vector))
+        return vector.tolist()
+
+    def get_many(self, text_hashes: List[str]) -> dict:
+        cache_qs = EmbeddingCache.objects.filter(
+            model=self.model, text_hash__in=set(text_hashes)
+        ).values_list("text_hash", "vector", "modified")
+
+        text_hash_2_vector = {}
+        stale_text_hashes = []
+        touch_before = timezone.now() - timedelta(days=EMBEDDING_CACHE_TOUCH_DAYS)
+        for text_hash, vector, modified in cache_qs:
+            text_hash_2_vector[text_hash] = self.unpack(vector)
+            if modified < touch_before:
+                stale_text_hashes.append(text_hash)
+
+        # 쓰인 cache 는 modified 를 갱신해서 prune 대상에서 빠지게 한다
+        if stale_text_hashes:
+            EmbeddingCache.objects.filter(
+                model=self.model, text_hash__in=stale_text_hashes
+            ).update(modified=timezone.now())
+        return text_hash_2_vector
+
+    def set_many(self, text_hash_2_vector: dict):
+        EmbeddingCache.objects.bulk_create(
+            [
+                EmbeddingCache(model=self.model, text_hash=text_hash, vector=self.pack(vector))
+                for text_hash, vector in text_hash_2_vector.items()
+            ],
+            ignore_conflicts=True
+        )
+
+    def embed(self, texts: List[str], embed_func: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        text_hashes = [self.get_text_hash(text) for text in texts]
+        text_hash_2_vector = self.get_many(text_hashes)
+
+        # 같은 요청 안에 중복된 text 는 한 번만 embedding 한다
+        text_hash_2_text = {
+            text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in text_hash_2_vector
+        }
+        if text_hash_2_text:
+            embedded_vectors = embed_func(list(text_hash_2_text.values()))
+            new_text_hash_2_vector = dict(zip(text_hash_2_text.keys(), embedded_vectors))
+            self.set_many(new_text_hash_2_vector)
+            text_hash_2_vector.update(new_text_hash_2_vector)
+
+        with self.lock:
+            self.hit_count += len(texts) - len(text_hash_2_text)
+            self.miss_count += len(text_hash_2_text)
+        return [text_hash_2_vector[text_hash] for text_hash in text_hashes]
+
+    @staticmethod
+    def prune(ttl_days: int = EMBEDDING_CACHE_TTL_DAYS, batch_size: int = EMBEDDING_CACHE_PRUNE_BATCH_SIZE) -> int:
+        # ttl_days 동안 쓰이지 않은 cache 를 batch_size 개씩 지운다. 한 번에 지우면 transaction 과 lock 이 길어진다
+        expired_before = timezone.now() - timedelta(days=ttl_days)
+        deleted_count = 0
+        while True:
+            expired_ids = list(
+                EmbeddingCache.objects.filter(modified__lt=expired_before).values_list("id", flat=True)[:batch_size]
+            )
+            if not expired_ids:
+                return deleted_count
+            deleted_count += EmbeddingCache.objects.filter(id__in=expired_ids).delete()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total else 0
+
+    def print_summary(self):
+        print(
+            f"embedding cache ({self.model}): hit {self.hit_count}, miss {self.miss_count}, "
+            f"hit rate {self.hit_rate * 100:.1f}%"
+        )
+
+
+class QueryEmbeddingCache:
+    """
+    (model, 정규화한 query) -> vector 의 process 내 LRU. 없으면 EmbeddingCache table 을 보고, 그래도 없을 때만 embedding 한다
+    """
+
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE, use_db: bool | None = QUERY_EMBEDDING_CACHE_USE_DB):
+        self.max_size = max_size
+        self.use_db = use_db
+        self.lock = threading.Lock()
+        self.vectors = OrderedDict()
+        self.hit_count = 0
+        self.db_hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.split()).lower()
+
+    def _get(self, key: tuple):
+        with self.lock:
+            vector = self.vectors.get(key)
+            if vector is not None:
+                self.vectors.move_to_end(key)
+                self.hit_count += 1
+            return vector
+
+    def _set(self, key: tuple, vector: List[float]):
+        with self.lock:
+            self.vectors[key] = vector
+            self.vectors.move_to_end(key)
+            while len(self.vectors) > self.max_size:
+                self.vectors.popitem(last=False)
+
+    def get_or_embed(self, embedding, query: str) -> List[float]:
+        normalized_query = self.normalize(query)
+        key = (embedding.model, normalized_query)
+        vector = self._get(key)
+        if vector is not None:
+            return vector
+
+        # local (onnx) provider 는 db 왕복보다 직접 embedding 하는 편이 빠르다
+        use_db = self.use_db if self.use_db is not None else not embedding.is_local
+        embedding_cache_store = EmbeddingCacheStore(embedding.model)
+        text_hash = embedding_cache_store.get_text_hash(normalized_query)
+        if use_db:
+            vector = embedding_cache_store.get_many([text_hash]).get(text_hash)
+        if vector is not None:
+            with self.lock:
+                self.db_hit_count += 1
+        else:
+            # 정규화는 cache key 에만 쓰고, embedding 은 사용자가 입력한 query 그대로 한다
+            vector = embedding.embed_query(query)
+            if use_db:
+                embedding_cache_store.set_many({text_hash: vector})
+            with self.lock:
+                self.miss_count += 1
+        self._set(key, vector)
+        return vector
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hit_count + self.db_hit_count + self.miss_count
+        return (self.hit_count + self.db_hit_count) / total if total else 0
+
+    def print_summary(self):
+        print(
+            f"query embedding cache: hit {self.hit_count}, db hit {self.db_hit_count}, miss {self.miss_count}, "
+            f"hit rate {self.hit_rate * 100:.1f}%"
+        )
+
+
+query_embedding_cache = QueryEmbeddingCache()
@@ -0,0 +1,33 @@
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# tiktoken 0.5.1 이 아는 model 만 둔다. 새 model 을 추가할 때는 tiktoken 도 함께 올린다
+EMBEDDING_MODEL_DIMS = {
+    "text-embedding-ada-002": 1536,
+}
+EMBEDDING_BATCH_TOKENS = 8000  # 한 요청에 담는 input token 합의 상한
+EMBEDDING_BATCH_SIZE = 2048  # openai 가 한 요청에 받는 input 개수 상한
+EMBEDDING_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 5
+EMBEDDING_BACKOFF_SECONDS = 1
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # process 당 보관하는 query vector 개수
+QUERY_EMBEDDING_CACHE_USE_DB = None  # EmbeddingCache table 로 process 간에도 공유. None 이면 원격 provider 일 때만
+EMBEDDING_CACHE_TTL_DAYS = 90  # 이 기간 동안 한 번도 쓰이지 않은 EmbeddingCache 는 지운다
+EMBEDDING_CACHE_TOUCH_DAYS = 1  # hit 때 modified 를 갱신하는 최소 간격. 매번 update 하지 않는다
+EMBEDDING_CACHE_PRUNE_BATCH_SIZE = 5000
+ES_CONNECTIONS_PER_NODE = 16  # process 가 공유하는 es client 의 node 당 keep-alive connection 수
+ES_REQUEST_TIMEOUT = 30
+ES_MAX_RETRIES = 3
+CHUNK_KNN_K = 4
+CHUNK_KNN_NUM_CANDIDATES = 50  # shard 당 후보 수. 늘리면 recall 이 오르고 latency 도 늘어난다
+CHUNK_KNN_MIN_SCORE = 0.91  # cosine 의 es _score = (1 + similarity) / 2
+RETRIEVAL_MODE = "vector"  # vector (knn 만) 또는 hybrid (bm25 + knn, rrf). hybrid 는 benchmark 로 확인한 뒤 켠다
+HYBRID_K = 4  # rrf 로 합친 뒤 돌려주는 document 수
+HYBRID_WINDOW_SIZE = 20  # bm25, knn 각각에서 가져오는 후보 수
+HYBRID_RRF_RANK_CONSTANT = 60
+# bm25 _score 는 query 길이와 index 통계에 따라 크기가 달라서, 절대값 대신 가장 높은 점수에 대한 비율로 자른다.
+# 1등 점수의 이 비율보다 낮은 bm25 후보는 rrf 순위에 넣지 않는다
+HYBRID_BM25_MIN_SCORE_RATIO = 0.3
+ES_BULK_CHUNK_SIZE = 500  # bulk 요청 하나에 담는 action 수 상한
+ES_BULK_MAX_CHUNK_BYTES = 5 * 1024 * 1024  # bulk 요청 하나의 크기 상한. vector 가 있는 chunk 는 개수보다 이 값에 먼저 걸린다
+ES_BULK_THREADS = 2
+ES_BULK_MAX_RETRIES = 3  # 429 로 거절된 item 만 다시 보낸다
+ES_BULK_INITIAL_BACKOFF = 2
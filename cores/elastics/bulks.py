@@ -0,0 +1,127 @@
+import threading
+from itertools import islice, chain
+from typing import Iterable, List
+
+from elasticsearch import Elasticsearch, helpers
+
+from cores.constants import ES_BULK_CHUNK_SIZE, ES_BULK_MAX_CHUNK_BYTES, ES_BULK_THREADS, ES_BULK_MAX_RETRIES, \
+    ES_BULK_INITIAL_BACKOFF
+
+
+class BulkResult:
+    def __init__(self):
+        self.success_count = 0
+        self.failed_items = []  # [{"_id", "status", "error"}]
+
+    @property
+    def failed_ids(self) -> List[str]:
+        return [item["_id"] for item in self.failed_items]
+
+    def print_summary(self, name: str):
+        print(f"{name} bulk: success {self.success_count}, failed {len(self.failed_items)}")
+        for item in self.failed_items[:5]:
+            print(f"  {item['_id']}: {item['status']} {item['error']}")
+
+
+class BulkWriteError(Exception):
+    def __init__(self, result: BulkResult):
+        self.result = result
+        super().__init__(f"{len(result.failed_items)} documents failed: {result.failed_ids[:10]}")
+
+
+class _LockedIterator:
+    # 여러 thread 의 streaming_bulk 가 action generator 하나를 나눠 읽는다
+    def __init__(self, iterable: Iterable):
+        self.iterator = iter(iterable)
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            return next(self.iterator)
+
+
+class BulkWriter:
+    """
+    action 을 generator 로 받아 개수 / byte 크기로 나눈 bulk 요청을 thread_count 개까지 동시에 보낸다.
+    한 번에 메모리에 올라가는 건 thread 당 bulk 요청 하나 분량이고, 429 로 거절된 item 만 backoff 후 다시 보낸다
+    """
+
+    def __init__(
+            self,
+            search_client: Elasticsearch,
+            chunk_size: int = ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+            thread_count: int = ES_BULK_THREADS,
+            max_retries: int = ES_BULK_MAX_RETRIES,
+            initial_backoff: float = ES_BULK_INITIAL_BACKOFF
+    ):
+        self.search_client = search_client
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = thread_count
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+
+    def write(self, actions: Iterable[dict]) -> BulkResult:
+        result = BulkResult()
+        lock = threading.Lock()
+        # bulk 요청 하나에 다 들어가는 적은 action 은 thread 를 띄우지 않고 호출한 thread 에서 보낸다
+        actions = iter(actions)
+        head_actions = list(islice(actions, self.chunk_size))
+        is_single_chunk = len(head_actions) < self.chunk_size
+        shared_actions = _LockedIterator(chain(head_actions, actions))
+
+        def consume():
+            for is_success, item in helpers.streaming_bulk(
+                    self.search_client,
+                    shared_actions,
+                    chunk_size=self.chunk_size,
+                    max_chunk_bytes=self.max_chunk_bytes,
+                    max_retries=self.max_retries,
+                    initial_backoff=self.initial_backoff,
+                    raise_on_error=False,
+                    raise_on_exception=False
+            ):
+                op_type, op_result = next(iter(item.items()))
+                # 이미 지워진 document 를 지우는 건 성공으로 본다
+                is_success = is_success or (op_type == "delete" and op_result.get("status") == 404)
+                with lock:
+                    if is_success:
+                        result.success_count += 1
+                    else:
+                        result.failed_items.append({
+                            "_id": op_result.get("_id"),
+                            "status": op_result.get("status"),
+                            "error": op_result.get("error") or op_result.get("exception")
+                        })
+
+        if self.thread_count <= 1 or is_single_chunk:
+            consume()
+            return result
+
+        errors = []
+
+        def run():
+            try:
+                consume()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(self.thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return result
+
+    def write_or_raise(self, actions: Iterable[dict], name: str) -> BulkResult:
+        result = self.write(actions)
+        if result.failed_items:
+            result.print_summary(name)
+            raise BulkWriteError(result)
+        return result
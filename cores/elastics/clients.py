@@ -1,50 +1,68 @@
-from typing import List
+import hashlib
+from itertools import chain
+from typing import List, Dict
 
 from django.conf import settings
-from elasticsearch import Elasticsearch, helpers
-from langchain.embeddings import OpenAIEmbeddings
+from elasticsearch import helpers
 from langchain.schema import Document
-from langchain.vectorstores import ElasticsearchStore
 
+from cores.caches import EmbeddingCacheStore, query_embedding_cache
+from cores.constants import CHUNK_KNN_K, CHUNK_KNN_NUM_CANDIDATES, CHUNK_KNN_MIN_SCORE, HYBRID_K, \
+    HYBRID_WINDOW_SIZE, HYBRID_RRF_RANK_CONSTANT, HYBRID_BM25_MIN_SCORE_RATIO
+from cores.llms.embeddings import get_embedding_provider
+from cores.elastics.bulks import BulkWriter
+from cores.elastics.connections import get_search_client
+from cores.elastics.indexes import IndexVersionManager
 from cores.elastics.mappings import original_index_mappings, chunk_index_mappings
 
 
+def original_document_id(user_id: int, url: str) -> str:
+    # 같은 page 는 항상 같은 id 로 index 되어 재시도해도 덮어쓰기만 된다
+    return hashlib.sha256(f"{user_id}:{url}".encode()).hexdigest()
+
+
+def chunk_document_id(user_id: int, url: str, chunk_ordinal: int) -> str:
+    return hashlib.sha256(f"{user_id}:{url}:{chunk_ordinal}".encode()).hexdigest()
+
+
+def user_routing(user_id: int) -> str:
+    # 한 user 의 document 는 모두 같은 shard 에 저장해서, 검색과 삭제가 그 shard 하나만 보도록 한다
+    return str(user_id)
+
+
 class OriginalContextClient:
-    def __init__(self):
-        self.search_client = Elasticsearch(
-            cloud_id=settings.ES_CLOUD_ID,
-            basic_auth=(settings.ES_USER, settings.ES_PASSWORD)
-        )
-        self.index = settings.ORIGINAL_DOCUMENT_INDEX
+    def __init__(self, index: str = None):
+        # index 를 넘기지 않으면 settings 의 alias 로 읽고 쓴다
+        self.search_client = get_search_client()
+        self.index = index or settings.ORIGINAL_DOCUMENT_INDEX
+        self.index_manager = IndexVersionManager(self.search_client, settings.ORIGINAL_DOCUMENT_INDEX, original_index_mappings)
 
-    def create_index(self, index=None):
-        if index:
-            self.index = index
-        is_index = self.search_client.indices.exists(index=self.index).body
-        if not is_index:
-            return self.search_client.indices.create(index=self.index, mappings=original_index_mappings)
+    def create_index(self):
+        self.index_manager.ensure()
 
     def delete_index(self):
         self.search_client.indices.delete(index=self.index)
 
-    def bulk_create(self, original_contexts):
-        results = []
-        for original_context in original_contexts:
-            results.append(
-                {
+    def bulk_create(self, original_contexts) -> List[str]:
+        # action 은 보낼 때 만들어서 한 번에 메모리에 올리지 않는다. 실패한 document 가 있으면 BulkWriteError
+        document_ids = []
+
+        def generate_actions():
+            for original_context in original_contexts:
+                document_id = original_document_id(original_context.user_id, original_context.url)
+                document_ids.append(document_id)
+                yield {
                     "_index": self.index,
+                    "_id": document_id,
+                    "_routing": user_routing(original_context.user_id),
                     "_source": original_context.dict()
                 }
-            )
-        helpers.bulk(self.search_client, results)
+
+        BulkWriter(self.search_client).write_or_raise(generate_actions(), self.index)
+        return document_ids
 
     def add_documents(self, original_contexts):
-        for context in original_contexts:
-            self.search_client.index(
-                index=settings.ORIGINAL_DOCUMENT_INDEX,
-                id=context.id,  # url 을 document id 로 설정
-                document=context.dict()
-            )
+        return self.bulk_create(original_contexts)
 
     def delete_documents(self, user, document_urls=None):
         if document_urls:
@@ -73,11 +91,13 @@ class OriginalContextClient:
 
         return self.search_client.delete_by_query(
             index=self.index,
-            query=query
+            query=query,
+            routing=user_routing(user.id)
         )
 
-    def search(self, query: str, user_id: int):
-        query = {
+    @staticmethod
+    def bm25_query(query: str, user_id: int) -> dict:
+        return {
             "bool": {
                 "must": [
                     {
@@ -103,10 +123,13 @@ class OriginalContextClient:
                 }
             }
         }
+
+    def search(self, query: str, user_id: int):
         response = self.search_client.search(
             index=self.index,
-            query=query,
-            sort=["_score"]
+            query=self.bm25_query(query, user_id),
+            sort=["_score"],
+            routing=user_routing(user_id)
         ).body
 
         hits = response['hits']
@@ -151,7 +174,8 @@ class OriginalContextClient:
                 sort=[
                     {"id": "asc"}
                 ],
-                search_after=[document_ids[-1]] if document_ids else None
+                search_after=[document_ids[-1]] if document_ids else None,
+                routing=user_routing(user.id)
             )
             if not response.body["hits"]["hits"]:
                 break
@@ -172,44 +196,163 @@ class OriginalContextClient:
                         {"terms": {"text_hash": text_hashes}},
                     ],
                 }
-            }
+            },
+            routing=user_routing(user.id)
         )
 
 
 class ChunkedContextClient:
-    def __init__(self):
-        self.embedding = OpenAIEmbeddings()
-        self.index = settings.CHUNKED_DOCUMENT_INDEX
-        self.vector_client = ElasticsearchStore(
-            es_cloud_id=settings.ES_CLOUD_ID,
-            index_name=self.index,
-            embedding=self.embedding,
-            es_user=settings.ES_USER,
-            es_password=settings.ES_PASSWORD
-        )
-        self.search_client = ElasticsearchStore.connect_to_elasticsearch(
-            cloud_id=settings.ES_CLOUD_ID,
-            username=settings.ES_USER,
-            password=settings.ES_PASSWORD
-        )
+    def __init__(self, index: str = None):
+        self.embedding = get_embedding_provider()
+        self.embedding_cache = EmbeddingCacheStore(self.embedding.model)
+        self.index = index or settings.CHUNKED_DOCUMENT_INDEX
+        self.search_client = get_search_client()
+        self.index_manager = IndexVersionManager(self.search_client, settings.CHUNKED_DOCUMENT_INDEX, chunk_index_mappings)
 
     def create_index(self):
-        is_index = self.search_client.indices.exists(index=self.index).body
-        if not is_index:
-            self.search_client.indices.create(index=self.index, mappings=chunk_index_mappings)
+        self.index_manager.ensure()
 
     def delete_index(self):
         self.search_client.indices.delete(index=self.index)
 
     def create_documents(self, chunked_documents: List[Document]):
-        ElasticsearchStore.from_documents(
-            chunked_documents,
-            self.embedding,
-            es_cloud_id=settings.ES_CLOUD_ID,
-            es_user=settings.ES_USER,
-            es_password=settings.ES_PASSWORD,
-            index_name=self.index
+        self.add_embedded_documents(chunked_documents, self.embed_documents(chunked_documents))
+
+    def embed_documents(self, chunked_documents: List[Document]) -> List[List[float]]:
+        return self.embedding_cache.embed(
+            [document.page_content for document in chunked_documents], self.embedding.embed_documents
+        )
+
+    def get_saved_chunks(self, user, document_urls: List[str]) -> Dict[str, tuple]:
+        # {document id: (url, chunk_ordinal, chunk_hash, vector)}
+        hits = helpers.scan(
+            self.search_client,
+            index=self.index,
+            query={
+                "query": {
+                    "bool": {
+                        "filter": [
+                            {"term": {"metadata.user_id": user.id}},
+                            {"terms": {"metadata.url": document_urls}}
+                        ]
+                    }
+                },
+                "_source": ["metadata.url", "metadata.chunk_ordinal", "metadata.chunk_hash", "vector"]
+            },
+            routing=user_routing(user.id)
+        )
+        saved_chunks = {}
+        for hit in hits:
+            metadata = hit["_source"].get("metadata", {})
+            saved_chunks[hit["_id"]] = (
+                metadata.get("url"),
+                metadata.get("chunk_ordinal"),
+                metadata.get("chunk_hash"),
+                hit["_source"].get("vector")
+            )
+        return saved_chunks
+
+    @staticmethod
+    def get_surplus_chunk_ids(saved_chunks: Dict[str, tuple], url_2_chunk_count: Dict[str, int]) -> Dict[str, list]:
+        # {url: [chunk id]}. chunk 개수가 줄어든 url 의 뒤쪽 chunk 와 chunk_ordinal 이 없는 예전 chunk
+        url_2_surplus_chunk_ids = {}
+        for document_id, (url, chunk_ordinal, _, _) in saved_chunks.items():
+            if url not in url_2_chunk_count:
+                continue
+            if chunk_ordinal is None or chunk_ordinal >= url_2_chunk_count[url]:
+                url_2_surplus_chunk_ids.setdefault(url, []).append(document_id)
+        return url_2_surplus_chunk_ids
+
+    def get_changed_chunks(self, user, chunked_documents: List[Document], document_urls: List[str] = None):
+        """
+        이미 저장된 chunk 와 비교해서 (index 할 chunk, vector, {url: 지울 chunk id}) 를 돌려준다.
+        같은 자리에 같은 내용이 있으면 건너뛰고, 자리만 바뀐 chunk 는 저장된 vector 를 다시 쓴다. embedding 할 chunk 의 vector 는 None.
+        document_urls 에는 chunk 가 하나도 남지 않은 url 도 넘긴다
+        """
+        url_2_chunk_count = {url: 0 for url in document_urls or []}
+        for document in chunked_documents:
+            url_2_chunk_count[document.metadata["url"]] = url_2_chunk_count.get(document.metadata["url"], 0) + 1
+        if not url_2_chunk_count:
+            return [], [], {}
+
+        saved_chunks = self.get_saved_chunks(user, list(url_2_chunk_count.keys()))
+        chunk_hash_2_vector = {
+            chunk_hash: vector for _, _, chunk_hash, vector in saved_chunks.values() if chunk_hash and vector
+        }
+
+        documents_for_index = []
+        vectors = []
+        for document in chunked_documents:
+            document_id = chunk_document_id(
+                document.metadata["user_id"], document.metadata["url"], document.metadata["chunk_ordinal"]
+            )
+            chunk_hash = document.metadata["chunk_hash"]
+            _, _, saved_chunk_hash, _ = saved_chunks.get(document_id, (None, None, None, None))
+            if saved_chunk_hash == chunk_hash:
+                continue
+            documents_for_index.append(document)
+            vectors.append(chunk_hash_2_vector.get(chunk_hash))
+        return documents_for_index, vectors, self.get_surplus_chunk_ids(saved_chunks, url_2_chunk_count)
+
+    def embed_missing_vectors(self, chunked_documents: List[Document], vectors: List) -> List[List[float]]:
+        # vector 가 None 인 chunk 만 한 번에 embedding 해서 채운다
+        documents_for_embed = [document for document, vector in zip(chunked_documents, vectors) if vector is None]
+        if not documents_for_embed:
+            return vectors
+        embedded_vectors = iter(self.embed_documents(documents_for_embed))
+        return [vector if vector is not None else next(embedded_vectors) for vector in vectors]
+
+    def embed_changed_documents(self, user, chunked_documents: List[Document], document_urls: List[str] = None):
+        # (index 할 chunk, vector, 지울 chunk id)
+        documents_for_index, vectors, url_2_surplus_chunk_ids = self.get_changed_chunks(
+            user, chunked_documents, document_urls
+        )
+        embed_count = vectors.count(None)
+        vectors = self.embed_missing_vectors(documents_for_index, vectors)
+        surplus_chunk_ids = [chunk_id for chunk_ids in url_2_surplus_chunk_ids.values() for chunk_id in chunk_ids]
+        print(
+            f"chunks: {len(chunked_documents)}개, unchanged: {len(chunked_documents) - len(documents_for_index)}개, "
+            f"reused: {len(documents_for_index) - embed_count}개, embedded: {embed_count}개, "
+            f"surplus: {len(surplus_chunk_ids)}개"
         )
+        return documents_for_index, vectors, surplus_chunk_ids
+
+    def add_embedded_documents(
+            self,
+            chunked_documents: List[Document],
+            vectors: List[List[float]],
+            surplus_chunk_ids: List[str] = None,
+            user=None
+    ):
+        # ElasticsearchStore 와 같은 document 형태 (text, vector, metadata) 로 저장한다.
+        # surplus_chunk_ids 는 같은 bulk 요청에서 id 로 지운다
+        actions = (
+            {
+                "_index": self.index,
+                "_id": chunk_document_id(
+                    document.metadata["user_id"], document.metadata["url"], document.metadata["chunk_ordinal"]
+                ),
+                "_routing": user_routing(document.metadata["user_id"]),
+                "_source": {
+                    "text": document.page_content,
+                    "vector": vector,
+                    "metadata": document.metadata
+                }
+            } for document, vector in zip(chunked_documents, vectors)
+        )
+        if surplus_chunk_ids:
+            actions = chain(actions, self.delete_chunk_actions(user, surplus_chunk_ids))
+        BulkWriter(self.search_client).write_or_raise(actions, self.index)
+
+    def delete_chunk_actions(self, user, chunk_ids: List[str]):
+        return (
+            {"_op_type": "delete", "_index": self.index, "_id": chunk_id, "_routing": user_routing(user.id)}
+            for chunk_id in chunk_ids
+        )
+
+    def delete_chunks(self, user, chunk_ids: List[str]):
+        if chunk_ids:
+            BulkWriter(self.search_client).write_or_raise(self.delete_chunk_actions(user, chunk_ids), self.index)
 
     def delete_documents(self, user, document_urls=None):
         if document_urls:
@@ -238,16 +381,144 @@ class ChunkedContextClient:
 
         return self.search_client.delete_by_query(
             index=self.index,
-            query=query
+            query=query,
+            routing=user_routing(user.id)
         )
 
     def refresh_index(self):
         self.search_client.indices.refresh(index=self.index)
 
-    def similarity_search(self, query: str, user_id: int) -> List[Document]:
-        results = self.vector_client.similarity_search_with_score(
-            query,
-            filter=[{"term": {"metadata.user_id": str(user_id)}}],
-            k=4
-        )
-        return [doc for doc, score in results if score > 0.91]
+    def embed_query(self, query: str) -> List[float]:
+        return query_embedding_cache.get_or_embed(self.embedding, query)
+
+    def similarity_search(self, query: str, user_id: int, query_vector: List[float] = None) -> List[Document]:
+        # query_vector 를 넘기면 query 를 다시 embedding 하지 않는다
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+        return self.knn_search(query_vector, user_id)
+
+    @staticmethod
+    def knn_query(
+            query_vector: List[float],
+            user_id: int,
+            k: int = CHUNK_KNN_K,
+            num_candidates: int = CHUNK_KNN_NUM_CANDIDATES,
+            min_score: float = CHUNK_KNN_MIN_SCORE
+    ) -> dict:
+        return {
+            "field": "vector",
+            "query_vector": query_vector,
+            "k": k,
+            "num_candidates": max(num_candidates, k),
+            "filter": {"term": {"metadata.user_id": user_id}},
+            "similarity": 2 * min_score - 1
+        }
+
+    def knn_search(
+            self,
+            query_vector: List[float],
+            user_id: int,
+            k: int = CHUNK_KNN_K,
+            num_candidates: int = CHUNK_KNN_NUM_CANDIDATES,
+            min_score: float = CHUNK_KNN_MIN_SCORE,
+            source_fields: List[str] = None
+    ) -> List[Document]:
+        """
+        es knn 검색. user_id 는 pre-filter 로, score cutoff 는 similarity 로 es 안에서 적용하고 vector 는 돌려받지 않는다
+        """
+        response = self.search_client.search(
+            index=self.index,
+            knn=self.knn_query(query_vector, user_id, k, num_candidates, min_score),
+            source=source_fields or ["text", "metadata"],
+            size=k,
+            routing=user_routing(user_id)
+        ).body
+        return [
+            Document(page_content=hit["_source"].get("text", ""), metadata=hit["_source"].get("metadata", {}))
+            for hit in response["hits"]["hits"]
+        ]
+
+
+class HybridContextClient:
+    """
+    original index 의 bm25 와 chunk index 의 knn 을 _msearch 한 번으로 보내고, url 단위 reciprocal rank fusion 으로 합친다
+    """
+
+    def __init__(self):
+        self.search_client = get_search_client()
+        self.original_client = OriginalContextClient()
+        self.chunked_client = ChunkedContextClient()
+
+    def search(
+            self,
+            query: str,
+            user_id: int,
+            query_vector: List[float] = None,
+            k: int = HYBRID_K,
+            window_size: int = HYBRID_WINDOW_SIZE,
+            rank_constant: int = HYBRID_RRF_RANK_CONSTANT,
+            bm25_min_score_ratio: float = HYBRID_BM25_MIN_SCORE_RATIO
+    ) -> List[dict]:
+        if query_vector is None:
+            query_vector = self.chunked_client.embed_query(query)
+
+        responses = self.search_client.msearch(searches=[
+            {"index": self.original_client.index, "routing": user_routing(user_id)},
+            {
+                "query": self.original_client.bm25_query(query, user_id),
+                "size": window_size,
+                "_source": ["url", "data_source_type"],
+                "highlight": {
+                    "fields": {"text": {"fragment_size": 200, "number_of_fragments": 2}},
+                    "pre_tags": [""],
+                    "post_tags": [""]
+                }
+            },
+            {"index": self.chunked_client.index, "routing": user_routing(user_id)},
+            {
+                "knn": self.chunked_client.knn_query(query_vector, user_id, k=window_size),
+                "size": window_size,
+                "_source": ["text", "metadata.url", "metadata.data_source_type"]
+            },
+        ]).body["responses"]
+        for response in responses:
+            if "error" in response:
+                print(f"hybrid search error: {response['error']}")
+        bm25_hits, knn_hits = [response.get("hits", {}).get("hits", []) for response in responses]
+        if bm25_hits:
+            bm25_min_score = bm25_hits[0]["_score"] * bm25_min_score_ratio
+            bm25_hits = [hit for hit in bm25_hits if hit["_score"] >= bm25_min_score]
+
+        url_2_result = {}
+        # knn 은 chunk 단위라 url 이 처음 나온 순위를 그 url 의 순위로 쓰고, 같은 url 의 chunk text 는 이어 붙인다
+        knn_urls = []
+        for hit in knn_hits:
+            metadata = hit["_source"].get("metadata", {})
+            url = metadata.get("url")
+            if url not in url_2_result:
+                url_2_result[url] = {
+                    "url": url, "data_source_type": metadata.get("data_source_type"), "score": 0, "chunked_texts": []
+                }
+                knn_urls.append(url)
+            url_2_result[url]["chunked_texts"].append(hit["_source"].get("text", ""))
+
+        bm25_urls = []
+        for hit in bm25_hits:
+            url = hit["_source"].get("url")
+            if url in bm25_urls:
+                continue
+            bm25_urls.append(url)
+            if url not in url_2_result:
+                url_2_result[url] = {
+                    "url": url, "data_source_type": hit["_source"].get("data_source_type"), "score": 0,
+                    "chunked_texts": hit.get("highlight", {}).get("text", [])
+                }
+
+        for urls in [bm25_urls, knn_urls]:
+            for rank, url in enumerate(urls):
+                url_2_result[url]["score"] += 1 / (rank_constant + rank + 1)
+
+        results = sorted(url_2_result.values(), key=lambda result: result["score"], reverse=True)[:k]
+        for result in results:
+            result["chunked_text"] = " ".join(result.pop("chunked_texts"))
+        return results
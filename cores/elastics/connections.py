@@ -0,0 +1,26 @@
+import threading
+
+from django.conf import settings
+from elasticsearch import Elasticsearch
+
+from cores.constants import ES_CONNECTIONS_PER_NODE, ES_REQUEST_TIMEOUT, ES_MAX_RETRIES
+
+_search_client = None
+_search_client_lock = threading.Lock()
+
+
+def get_search_client() -> Elasticsearch:
+    # es client 는 thread-safe 하므로 process 당 하나를 만들어 connection pool 과 tls 세션을 재사용한다
+    global _search_client
+    with _search_client_lock:
+        if _search_client is None:
+            _search_client = Elasticsearch(
+                cloud_id=settings.ES_CLOUD_ID,
+                basic_auth=(settings.ES_USER, settings.ES_PASSWORD),
+                connections_per_node=ES_CONNECTIONS_PER_NODE,
+                request_timeout=ES_REQUEST_TIMEOUT,
+                max_retries=ES_MAX_RETRIES,
+                retry_on_timeout=True,
+                http_compress=True
+            )
+        return _search_client
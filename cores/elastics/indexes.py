@@ -0,0 +1,73 @@
+import re
+from typing import List
+
+from elasticsearch import Elasticsearch
+
+
+class IndexVersionManager:
+    """
+    settings 의 index 이름은 alias 로 쓰고, 실제 index 는 {alias}_v{n} 으로 만든다.
+    새 version 을 다 채운 뒤 alias 를 한 번의 update_aliases 로 옮기므로 검색이 끊기지 않는다
+    """
+
+    def __init__(self, search_client: Elasticsearch, alias: str, mappings: dict):
+        self.search_client = search_client
+        self.alias = alias
+        self.mappings = mappings
+
+    def version_index(self, version: int) -> str:
+        return f"{self.alias}_v{version}"
+
+    def get_alias_indexes(self) -> List[str]:
+        if not self.search_client.indices.exists_alias(name=self.alias).body:
+            return []
+        return list(self.search_client.indices.get_alias(name=self.alias).body.keys())
+
+    def is_legacy_index(self) -> bool:
+        # alias 도입 전에 alias 이름 그대로 만든 index
+        return self.search_client.indices.exists(index=self.alias).body and not self.get_alias_indexes()
+
+    def get_versions(self) -> List[int]:
+        indexes = self.search_client.indices.get(index=f"{self.alias}_v*", allow_no_indices=True).body.keys()
+        pattern = re.compile(rf"^{re.escape(self.alias)}_v(\d+)$")
+        return sorted(int(match.group(1)) for match in map(pattern.match, indexes) if match)
+
+    def ensure(self):
+        # alias 도 index 도 없으면 v1 을 만들어 alias 를 붙인다
+        if self.search_client.indices.exists(index=self.alias).body:
+            return
+        index = self.create_version(is_bulk_load=False)
+        self.search_client.indices.put_alias(index=index, name=self.alias)
+
+    def create_version(self, is_bulk_load: bool = True) -> str:
+        versions = self.get_versions()
+        index = self.version_index(versions[-1] + 1 if versions else 1)
+        settings = {"number_of_replicas": 0, "refresh_interval": "-1"} if is_bulk_load else None
+        self.search_client.indices.create(index=index, mappings=self.mappings, settings=settings)
+        return index
+
+    def finish_bulk_load(self, index: str, number_of_replicas: int = None):
+        if number_of_replicas is None:
+            number_of_replicas = self.get_number_of_replicas()
+        self.search_client.indices.put_settings(
+            index=index, settings={"number_of_replicas": number_of_replicas, "refresh_interval": None}
+        )
+        self.search_client.indices.refresh(index=index)
+
+    def get_number_of_replicas(self) -> int:
+        current_indexes = self.get_alias_indexes() or ([self.alias] if self.is_legacy_index() else [])
+        if not current_indexes:
+            return 1
+        index_settings = self.search_client.indices.get_settings(index=current_indexes[0]).body
+        return int(next(iter(index_settings.values()))["settings"]["index"]["number_of_replicas"])
+
+    def swap(self, index: str, delete_legacy_index: bool = False) -> List[str]:
+        actions = [{"remove": {"index": old_index, "alias": self.alias}} for old_index in self.get_alias_indexes()]
+        if self.is_legacy_index():
+            if not delete_legacy_index:
+                raise ValueError(f"{self.alias} 는 alias 가 아닌 index 입니다. delete_legacy_index 로 같이 교체해야 합니다")
+            # 같은 요청 안에서 지워야 alias 이름이 비는 순간이 없다
+            actions.append({"remove_index": {"index": self.alias}})
+        actions.append({"add": {"index": index, "alias": self.alias}})
+        self.search_client.indices.update_aliases(actions=actions)
+        return [action["remove"]["index"] for action in actions if "remove" in action]
@@ -1,3 +1,5 @@
+from django.conf import settings
+
 original_index_mappings = {
     "properties": {
         "title": {
@@ -47,6 +49,12 @@ chunk_index_mappings = {
                 },
                 "user_id": {
                     "type": "long"
+                },
+                "chunk_ordinal": {
+                    "type": "integer"
+                },
+                "chunk_hash": {
+                    "type": "keyword"
                 }
             }
         },
@@ -55,7 +63,7 @@ chunk_index_mappings = {
         },
         "vector": {
             "type": "dense_vector",
-            "dims": 1536,
+            "dims": settings.EMBEDDING_DIMS,
             "index": True,
             "similarity": "cosine"
         }
@@ -0,0 +1,203 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+import openai
+import tiktoken
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from langchain.embeddings.base import Embeddings
+
+from cores.constants import EMBEDDING_MODEL, EMBEDDING_MODEL_DIMS, EMBEDDING_BATCH_TOKENS, EMBEDDING_BATCH_SIZE, \
+    EMBEDDING_CONCURRENCY, EMBEDDING_MAX_RETRIES, EMBEDDING_BACKOFF_SECONDS
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    text 들을 token 합이 max_batch_tokens 를 넘지 않게 묶어서, 최대 max_workers 개의 요청을 동시에 보낸다.
+    429 / 5xx / 연결 오류는 Retry-After (없으면 exponential backoff) 만큼 모든 요청이 함께 기다린 뒤 다시 보낸다
+    """
+    is_local = False
+
+    def __init__(
+            self,
+            model: str = EMBEDDING_MODEL,
+            max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+            max_batch_size: int = EMBEDDING_BATCH_SIZE,
+            max_workers: int = EMBEDDING_CONCURRENCY,
+            max_retries: int = EMBEDDING_MAX_RETRIES
+    ):
+        self.model = model
+        self.dims = EMBEDDING_MODEL_DIMS[model]
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.encoder = tiktoken.encoding_for_model(model)
+        self.lock = threading.Lock()
+        self.paused_until = 0
+        self.batch_latencies = []
+        self.token_count = 0
+        self.retry_count = 0
+
+    def pack(self, texts: List[str]) -> List[List[int]]:
+        # text 순서를 유지한 채 index 를 batch 로 나눈다. 상한보다 긴 text 는 혼자 한 batch 가 된다
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for index, text in enumerate(texts):
+            num_tokens = len(self.encoder.encode(text))
+            if batch and (batch_tokens + num_tokens > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(index)
+            batch_tokens += num_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self.pack(texts)
+        if len(batches) == 1 or self.max_workers == 1:
+            batch_vectors = [self._embed_batch([texts[index] for index in batch]) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                batch_vectors = list(executor.map(
+                    lambda batch: self._embed_batch([texts[index] for index in batch]), batches
+                ))
+
+        vectors = [None] * len(texts)
+        for batch, vectors_of_batch in zip(batches, batch_vectors):
+            for index, vector in zip(batch, vectors_of_batch):
+                vectors[index] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _wait_if_paused(self):
+        wait_seconds = self.paused_until - time.monotonic()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def _pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.retry_count += 1
+
+    def _embed_batch(self, batch_texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self._wait_if_paused()
+            start_time = time.perf_counter()
+            try:
+                response = openai.Embedding.create(model=self.model, input=batch_texts)
+            except (
+                    openai.error.RateLimitError,
+                    openai.error.ServiceUnavailableError,
+                    openai.error.Timeout,
+                    openai.error.APIError,
+                    openai.error.APIConnectionError
+            ) as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = (e.headers or {}).get("retry-after")
+                self._pause(
+                    float(retry_after) if retry_after else EMBEDDING_BACKOFF_SECONDS * 2 ** attempt + random.random()
+                )
+                continue
+
+            with self.lock:
+                self.batch_latencies.append(time.perf_counter() - start_time)
+                self.token_count += response["usage"]["total_tokens"]
+            return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+    def print_summary(self):
+        if not self.batch_latencies:
+            return
+        latencies = sorted(self.batch_latencies)
+        print(
+            f"embedding batches: {len(latencies)}개, tokens: {self.token_count}, retries: {self.retry_count}, "
+            f"latency avg {sum(latencies) / len(latencies):.2f}s / "
+            f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s / "
+            f"max {latencies[-1]:.2f}s"
+        )
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    ONNX 로 export 한 sentence encoder 를 cpu 에서 실행한다. mean pooling 후 L2 normalize
+    model_dir 에는 model.onnx 와 tokenizer.json (huggingface tokenizers) 이 있어야 한다
+    """
+    is_local = True
+
+    def __init__(self, model_dir: str, batch_size: int = 32, max_length: int = 256):
+        # lambda 배포에는 포함하지 않는 무거운 의존성이라 사용할 때만 import 한다
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model = f"onnx:{os.path.basename(os.path.normpath(model_dir))}"
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.dims = self.session.get_outputs()[0].shape[-1]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    def print_summary(self):
+        pass
+
+
+_embedding_provider = None
+_embedding_provider_lock = threading.Lock()
+
+
+def get_embedding_provider() -> Embeddings:
+    # onnx session 은 load 비용이 커서 process 당 하나만 만든다
+    global _embedding_provider
+    with _embedding_provider_lock:
+        if _embedding_provider is None:
+            if settings.EMBEDDING_PROVIDER == "onnx":
+                embedding_provider = OnnxEmbeddings(settings.EMBEDDING_ONNX_MODEL_DIR)
+            else:
+                embedding_provider = BatchedEmbeddings()
+            # chunk index mapping 의 dims 와 다르면 index 할 때마다 실패하므로 시작할 때 막는다
+            if embedding_provider.dims != settings.EMBEDDING_DIMS:
+                raise ImproperlyConfigured(
+                    f"{embedding_provider.model} dims {embedding_provider.dims} "
+                    f"!= EMBEDDING_DIMS {settings.EMBEDDING_DIMS}"
+                )
+            _embedding_provider = embedding_provider
+        return _embedding_provider
@@ -1,7 +1,9 @@
 import os
+from functools import lru_cache
 
 import openai
 from django.conf import settings
+from langchain.chat_models import ChatOpenAI
 
 from cores.utils import print_execution_time
 
@@ -24,3 +26,9 @@ class ChatCompletion:
 
     def __init__(self) -> None:
         pass
+
+
+@lru_cache(maxsize=None)
+def get_chat_model(model_name: str = "gpt-3.5-turbo", temperature: float = 0.1) -> ChatOpenAI:
+    # 요청마다 model 을 새로 만들지 않고 process 안에서 공유한다
+    return ChatOpenAI(model_name=model_name, temperature=temperature)
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.3 on 2023-12-04 06:12
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('model', models.CharField(max_length=100)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('vector', models.BinaryField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='embeddingcache',
+            constraint=models.UniqueConstraint(fields=('model', 'text_hash'), name='unique_embedding_cache'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2023-12-08 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cores', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='embeddingcache',
+            index=models.Index(fields=['modified'], name='embedding_cache_modified'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from datetime import datetime
 
 from django.db import models
+from django_extensions.db.models import TimeStampedModel
 
 # Create your models here.
 
@@ -26,3 +27,19 @@ class SoftDeleteModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class EmbeddingCache(TimeStampedModel):
+    # (embedding model, sha256(text)) -> float32 로 pack 한 vector. user 와 상관없이 같은 text 면 같은 vector
+    # modified 는 마지막으로 쓰인 시각이다. 오래 쓰이지 않은 row 는 cores.tasks.prune_embedding_cache 가 지운다
+    model = models.CharField(max_length=100)
+    text_hash = models.CharField(max_length=64)
+    vector = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["model", "text_hash"], name="unique_embedding_cache")
+        ]
+        indexes = [
+            models.Index(fields=["modified"], name="embedding_cache_modified")
+        ]
@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from typing import List, Iterable
+
+from django.db import connection
+
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    func 는 item 하나를 받아 다음 stage 로 넘길 item 들의 list 를 돌려준다.
+    batch_size 를 주면 func 는 item 들의 list 를 받는다. 하나가 들어오면 queue 에 이미 쌓인 item 을 batch_size 개,
+    또는 batch_weight(item) 의 합이 max_batch_weight 에 닿을 때까지 더 모으고, queue 가 비면 모인 만큼만 넘긴다
+    """
+
+    def __init__(
+            self,
+            name: str,
+            func,
+            workers: int = 1,
+            queue_size: int = 8,
+            batch_size: int = None,
+            max_batch_weight: int = None,
+            batch_weight=None
+    ):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_batch_weight = max_batch_weight
+        self.batch_weight = batch_weight
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.remaining_workers = workers
+        self.processed_count = 0
+        self.output_count = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.queue_depth_sum = 0
+        self.max_queue_depth = 0
+        self.errors = []
+
+    def get_batch(self, item) -> tuple[list, bool]:
+        # (batch, batch 를 모으다 _STOP 을 받았는지)
+        batch = [item]
+        weight = self.batch_weight(item) if self.batch_weight else 0
+        while len(batch) < self.batch_size and (self.max_batch_weight is None or weight < self.max_batch_weight):
+            try:
+                item = self.input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            weight += self.batch_weight(item) if self.batch_weight else 0
+        return batch, False
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "processed": self.processed_count,
+            "outputs": self.output_count,
+            "errors": len(self.errors),
+            "throughput": self.processed_count / elapsed if elapsed else 0,
+            "utilization": self.busy_seconds / (elapsed * self.workers) if elapsed else 0,
+            "blocked_seconds": self.blocked_seconds,
+            "avg_queue_depth": self.queue_depth_sum / self.processed_count if self.processed_count else 0,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class Pipeline:
+    """
+    stage 마다 worker thread 들을 두고 bounded queue 로 연결한다.
+    다음 stage 의 queue 가 가득 차면 앞 stage 는 기다리므로 (backpressure) memory 가 일정하게 유지된다
+    """
+
+    def __init__(self, stages: List[PipelineStage]):
+        self.stages = stages
+        self.elapsed = 0.0
+
+    def run(self, items: Iterable):
+        s = time.perf_counter()
+        threads = []
+        for idx, stage in enumerate(self.stages):
+            next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        first_stage = self.stages[0]
+        for item in items:
+            first_stage.input_queue.put(item)
+        for _ in range(first_stage.workers):
+            first_stage.input_queue.put(_STOP)
+
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - s
+
+    @staticmethod
+    def _work(stage: PipelineStage, next_stage: PipelineStage | None):
+        try:
+            while True:
+                item = stage.input_queue.get()
+                if item is _STOP:
+                    break
+                queue_depth = stage.input_queue.qsize()
+                if stage.batch_size:
+                    items, is_stopped = stage.get_batch(item)
+                else:
+                    items, is_stopped = [item], False
+
+                s = time.perf_counter()
+                try:
+                    outputs = (stage.func(items) if stage.batch_size else stage.func(item)) or []
+                except Exception as e:
+                    outputs = []
+                    stage.errors.append(e)
+                busy_seconds = time.perf_counter() - s
+
+                s = time.perf_counter()
+                if next_stage:
+                    for output in outputs:
+                        next_stage.input_queue.put(output)
+                blocked_seconds = time.perf_counter() - s
+
+                with stage.lock:
+                    stage.processed_count += len(items)
+                    stage.output_count += len(outputs)
+                    stage.busy_seconds += busy_seconds
+                    stage.blocked_seconds += blocked_seconds
+                    stage.queue_depth_sum += queue_depth * len(items)
+                    stage.max_queue_depth = max(stage.max_queue_depth, queue_depth)
+                if is_stopped:
+                    break
+        finally:
+            # stage 함수가 orm 을 쓰면 thread 마다 connection 이 열리므로 같이 정리한다
+            connection.close()
+            with stage.lock:
+                stage.remaining_workers -= 1
+                is_last_worker = stage.remaining_workers == 0
+            if is_last_worker and next_stage:
+                for _ in range(next_stage.workers):
+                    next_stage.input_queue.put(_STOP)
+
+    @property
+    def errors(self) -> list:
+        return [error for stage in self.stages for error in stage.errors]
+
+    def stats(self) -> List[dict]:
+        return [stage.stats(self.elapsed) for stage in self.stages]
+
+    def print_summary(self):
+        print(f"pipeline finished in {self.elapsed:.2f}s")
+        for stats in self.stats():
+            print(
+                f"  {stats['name']}: {stats['processed']} items -> {stats['outputs']} outputs "
+                f"({stats['errors']} errors), {stats['throughput']:.2f} items/s, "
+                f"utilization {stats['utilization']:.0%} x {stats['workers']} workers, "
+                f"blocked {stats['blocked_seconds']:.2f}s, "
+                f"queue depth avg {stats['avg_queue_depth']:.1f} / max {stats['max_queue_depth']}"
+            )
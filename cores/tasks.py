@@ -0,0 +1,8 @@
+from cores.caches import EmbeddingCacheStore
+
+
+def prune_embedding_cache(event=None, context=None):
+    # zappa schedule 로 하루에 한 번 실행한다
+    deleted_count = EmbeddingCacheStore.prune()
+    print(f"embedding cache pruned: {deleted_count}개")
+    return deleted_count
@@ -1,3 +1,156 @@
-from django.test import TestCase
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from cores.elastics.bulks import BulkWriter, BulkWriteError
+from cores.llms.embeddings import BatchedEmbeddings
+from cores.pipelines import Pipeline, PipelineStage
+from cores.utils import TokenBucket
+
+
+class TokenBucketTest(SimpleTestCase):
+    def test_burst_up_to_capacity_does_not_wait(self):
+        token_bucket = TokenBucket(rate=10, capacity=5)
+
+        s = time.monotonic()
+        for _ in range(5):
+            token_bucket.acquire()
+
+        self.assertLess(time.monotonic() - s, 0.05)
+
+    def test_acquire_waits_for_refill(self):
+        token_bucket = TokenBucket(rate=20, capacity=1)
+        token_bucket.acquire()
+
+        s = time.monotonic()
+        token_bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - s, 0.04)
+
+    def test_pause_blocks_until_debt_is_refilled(self):
+        token_bucket = TokenBucket(rate=20, capacity=1)
+        token_bucket.pause(0.1)
+
+        s = time.monotonic()
+        token_bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - s, 0.1)
+
+
+class PipelineTest(SimpleTestCase):
+    def test_stage_error_does_not_stop_pipeline(self):
+        saved_items = []
+
+        def parse(item):
+            if item == 3:
+                raise ValueError(item)
+            return [item * 10]
+
+        pipeline = Pipeline([
+            PipelineStage("parse", parse, workers=2, queue_size=2),
+            PipelineStage("save", lambda item: saved_items.append(item), workers=1, queue_size=2),
+        ])
+        pipeline.run(range(6))
+
+        self.assertEqual(sorted(saved_items), [0, 10, 20, 40, 50])
+        self.assertEqual([type(error) for error in pipeline.errors], [ValueError])
+        self.assertEqual([stats["processed"] for stats in pipeline.stats()], [6, 5])
+
+    def test_batch_stage_receives_queued_items_together(self):
+        batches = []
+
+        def save(items):
+            batches.append(items)
+            return []
+
+        save_stage = PipelineStage("save", save, workers=1, queue_size=10, batch_size=3)
+        pipeline = Pipeline([save_stage])
+        # worker 가 시작하기 전에 queue 를 채워서 batch 가 항상 가득 차도록 한다
+        for item in range(7):
+            save_stage.input_queue.put(item)
+        pipeline.run([])
+
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(pipeline.stats()[0]["processed"], 7)
+
+
+class BatchedEmbeddingsPackTest(SimpleTestCase):
+    def setUp(self):
+        # 단어 하나를 token 하나로 센다
+        encoder = SimpleNamespace(encode=lambda text: text.split())
+        with mock.patch("cores.llms.embeddings.tiktoken.encoding_for_model", return_value=encoder):
+            self.embedding = BatchedEmbeddings(max_batch_tokens=4, max_batch_size=3)
+
+    def test_pack_by_token_budget(self):
+        batches = self.embedding.pack(["a b", "c d", "e", "f g h"])
+
+        self.assertEqual(batches, [[0, 1], [2, 3]])
+
+    def test_pack_by_batch_size(self):
+        batches = self.embedding.pack(["a", "b", "c", "d"])
+
+        self.assertEqual(batches, [[0, 1, 2], [3]])
+
+    def test_long_text_gets_its_own_batch(self):
+        batches = self.embedding.pack(["a", "b c d e f", "g"])
+
+        self.assertEqual(batches, [[0], [1], [2]])
+
+
+def fake_streaming_bulk(search_client, actions, **kwargs):
+    for action in actions:
+        if action.get("_op_type") == "delete":
+            yield False, {"delete": {"_id": action["_id"], "status": 404}}
+        elif action["_id"] == "bad":
+            yield False, {"index": {"_id": "bad", "status": 400, "error": "mapper_parsing_exception"}}
+        else:
+            yield True, {"index": {"_id": action["_id"], "status": 201}}
+
+
+@mock.patch("cores.elastics.bulks.helpers.streaming_bulk", side_effect=fake_streaming_bulk)
+class BulkWriterTest(SimpleTestCase):
+    def test_write_counts_success_and_failure(self, streaming_bulk):
+        result = BulkWriter(None, thread_count=1).write([{"_id": "a"}, {"_id": "bad"}, {"_id": "b"}])
+
+        self.assertEqual(result.success_count, 2)
+        self.assertEqual(result.failed_ids, ["bad"])
+
+    def test_write_or_raise(self, streaming_bulk):
+        with self.assertRaises(BulkWriteError) as context:
+            BulkWriter(None, thread_count=1).write_or_raise([{"_id": "a"}, {"_id": "bad"}], "test")
+
+        self.assertEqual(context.exception.result.failed_ids, ["bad"])
+
+    def test_delete_of_missing_document_is_success(self, streaming_bulk):
+        result = BulkWriter(None, thread_count=1).write_or_raise([{"_op_type": "delete", "_id": "gone"}], "test")
+
+        self.assertEqual(result.success_count, 1)
+
+    def test_retry_options_are_passed_to_streaming_bulk(self, streaming_bulk):
+        BulkWriter(None, thread_count=1, max_retries=5, initial_backoff=0.5).write([{"_id": "a"}])
+
+        self.assertEqual(streaming_bulk.call_args.kwargs["max_retries"], 5)
+        self.assertEqual(streaming_bulk.call_args.kwargs["initial_backoff"], 0.5)
+        self.assertFalse(streaming_bulk.call_args.kwargs["raise_on_error"])
+
+    def test_threads_share_one_action_iterator(self, streaming_bulk):
+        result = BulkWriter(None, chunk_size=10, thread_count=3).write({"_id": str(index)} for index in range(100))
+
+        self.assertEqual(result.success_count, 100)
+        self.assertEqual(streaming_bulk.call_count, 3)
+
+    def test_single_chunk_is_written_on_calling_thread(self, streaming_bulk):
+        thread_names = []
+
+        def streaming_bulk_on_thread(search_client, actions, **kwargs):
+            thread_names.append(threading.current_thread().name)
+            return fake_streaming_bulk(search_client, actions, **kwargs)
+
+        streaming_bulk.side_effect = streaming_bulk_on_thread
+        result = BulkWriter(None, chunk_size=10, thread_count=3).write({"_id": str(index)} for index in range(9))
+
+        self.assertEqual(result.success_count, 9)
+        self.assertEqual(thread_names, [threading.current_thread().name])
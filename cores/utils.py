@@ -1,3 +1,4 @@
+import threading
 import time
 
 from langchain.callbacks import get_openai_callback
@@ -30,12 +31,42 @@ def get_host_url(request):
     return f"{scheme}://{host_url}"
 
 
-def split_list_and_run(overall_list: list, split_num: int, func, *args):
+def split_list(overall_list: list, split_num: int) -> list:
     overall_split_list = []
     for i in range(0, len(overall_list), split_num):
-        split_list = overall_list[i:i + split_num]
-        overall_split_list.append(split_list)
+        overall_split_list.append(overall_list[i:i + split_num])
+    return overall_split_list
 
-    for split_list in overall_split_list:
-        if split_list:
-            func(split_list, *args)
+
+class TokenBucket:
+    """
+    thread-safe token bucket. rate 개/초 로 token 이 채워지고, 최대 capacity 개까지 burst 를 허용한다
+    """
+
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens: int = 1):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def pause(self, seconds: float):
+        # Retry-After 처럼 서버가 대기를 요구하면, 모든 thread 가 seconds 동안 token 을 얻지 못하도록 빚을 만든다
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
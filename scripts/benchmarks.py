@@ -0,0 +1,188 @@
+import random
+import time
+from types import SimpleNamespace
+
+from sources.diffs import NotionDiff
+
+
+def bench_embedding(page_count: int = 500, chunks_per_page: int = 50):
+    """
+    shell_plus 에서 호출. openai 를 실제로 호출하므로 비용이 든다
+    """
+    from langchain.embeddings import OpenAIEmbeddings
+    from cores.llms.embeddings import BatchedEmbeddings
+
+    texts = [
+        f"{page_index}번 page 의 {chunk_index}번째 문단. " * 8
+        for page_index in range(page_count) for chunk_index in range(chunks_per_page)
+    ]
+
+    start_time = time.perf_counter()
+    OpenAIEmbeddings().embed_documents(texts)
+    print(f"[{len(texts)} chunks] langchain default: {time.perf_counter() - start_time:.1f}s")
+
+    batched_embeddings = BatchedEmbeddings()
+    start_time = time.perf_counter()
+    batched_embeddings.embed_documents(texts)
+    print(f"[{len(texts)} chunks] token packed + concurrent: {time.perf_counter() - start_time:.1f}s")
+    batched_embeddings.print_summary()
+
+
+def _make_pages(page_count: int, changed_ratio: float = 0.05, created_ratio: float = 0.05):
+    saved = {f"https://www.notion.so/page-{index}": f"hash-{index}" for index in range(page_count)}
+    pages = []
+    for index in range(page_count):
+        url = f"https://www.notion.so/page-{index}"
+        text_hash = f"hash-{index}-changed" if random.random() < changed_ratio else saved[url]
+        pages.append(SimpleNamespace(url=url, text_hash=text_hash))
+    for index in range(int(page_count * created_ratio)):
+        pages.append(SimpleNamespace(url=f"https://www.notion.so/new-page-{index}", text_hash=f"new-hash-{index}"))
+    return saved, pages
+
+
+def _list_based_diff(saved: dict, pages: list):
+    # 예전 NotionSync 방식: url / text_hash 를 list 로 들고 page 마다 선형 탐색
+    saved_document_urls = list(saved.keys())
+    saved_text_hashes = list(saved.values())
+    created = [page for page in pages if page.url not in saved_document_urls]
+    existed_document_urls = set(saved_document_urls) & {page.url for page in pages}
+    changed_text_hashes = {page.text_hash for page in pages} - set(saved_text_hashes)
+    updated = [page for page in pages if page.url in existed_document_urls and page.text_hash in changed_text_hashes]
+    return created, updated
+
+
+def bench_notion_diff(page_counts=(10_000, 100_000), list_based_limit: int = 10_000):
+    """
+    shell_plus 에서 호출. list 기반 diff 는 O(n*m) 이라 list_based_limit 이하에서만 돌린다
+    """
+    for page_count in page_counts:
+        saved, pages = _make_pages(page_count)
+
+        start_time = time.perf_counter()
+        notion_diff_result = NotionDiff(dict(saved)).classify(pages)
+        deleted_urls = NotionDiff(dict(saved)).deleted_urls(page.url for page in pages)
+        set_elapsed = time.perf_counter() - start_time
+        print(f"[{page_count} pages] set based: {set_elapsed * 1000:.1f}ms, {notion_diff_result}, deleted={len(deleted_urls)}")
+
+        if page_count > list_based_limit:
+            print(f"[{page_count} pages] list based: skipped")
+            continue
+        start_time = time.perf_counter()
+        created, updated = _list_based_diff(saved, pages)
+        list_elapsed = time.perf_counter() - start_time
+        print(
+            f"[{page_count} pages] list based: {list_elapsed * 1000:.1f}ms, created={len(created)}, updated={len(updated)}"
+            f" (x{list_elapsed / set_elapsed:.0f})"
+        )
+
+
+def bench_query_embedding(onnx_model_dir: str, query_count: int = 100, batch_size: int = 32):
+    """
+    shell_plus 에서 호출. query 한 개 latency (chat 경로) 와 document batch throughput (sync 경로) 을 provider 별로 잰다
+    """
+    from cores.llms.embeddings import BatchedEmbeddings, OnnxEmbeddings
+
+    queries = [f"{index}번째 회의록에서 정한 다음 일정이 뭐였지?" for index in range(query_count)]
+    for embedding in [BatchedEmbeddings(), OnnxEmbeddings(onnx_model_dir)]:
+        latencies = []
+        for query in queries:
+            start_time = time.perf_counter()
+            embedding.embed_query(query)
+            latencies.append(time.perf_counter() - start_time)
+        latencies.sort()
+
+        start_time = time.perf_counter()
+        embedding.embed_documents(queries[:batch_size] * 10)
+        throughput = batch_size * 10 / (time.perf_counter() - start_time)
+        print(
+            f"[{embedding.model}] query p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms, documents {throughput:.0f}/s"
+        )
+
+
+def bench_knn(user_id: int, queries: list, k: int = 4, num_candidates_list=(10, 25, 50, 100, 200), repeat: int = 5):
+    """
+    shell_plus 에서 호출. num_candidates 별 knn latency 와, script_score 로 구한 정확한 top k 대비 recall 을 잰다
+    """
+    from cores.elastics.clients import ChunkedContextClient
+
+    chunked_client = ChunkedContextClient()
+    query_vectors = [chunked_client.embed_query(query) for query in queries]
+    exact_ids = []
+    for query_vector in query_vectors:
+        response = chunked_client.search_client.search(
+            index=chunked_client.index,
+            query={
+                "script_score": {
+                    "query": {"term": {"metadata.user_id": user_id}},
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
+                        "params": {"query_vector": query_vector}
+                    }
+                }
+            },
+            source=False,
+            size=k
+        ).body
+        exact_ids.append({hit["_id"] for hit in response["hits"]["hits"]})
+
+    for num_candidates in num_candidates_list:
+        latencies = []
+        recalls = []
+        for query_vector, exact_id_set in zip(query_vectors, exact_ids):
+            for _ in range(repeat):
+                response = chunked_client.search_client.search(
+                    index=chunked_client.index,
+                    knn={
+                        "field": "vector",
+                        "query_vector": query_vector,
+                        "k": k,
+                        "num_candidates": max(num_candidates, k),
+                        "filter": {"term": {"metadata.user_id": user_id}}
+                    },
+                    source=False,
+                    size=k
+                ).body
+                latencies.append(response["took"])
+            knn_id_set = {hit["_id"] for hit in response["hits"]["hits"]}
+            recalls.append(len(knn_id_set & exact_id_set) / len(exact_id_set) if exact_id_set else 1)
+        latencies.sort()
+        print(
+            f"[num_candidates {num_candidates}] recall@{k} {sum(recalls) / len(recalls):.3f}, "
+            f"took p50 {latencies[len(latencies) // 2]}ms, p95 {latencies[int(len(latencies) * 0.95) - 1]}ms"
+        )
+
+
+def bench_retrieval(user, labelled_queries: list, repeat: int = 3):
+    """
+    shell_plus 에서 호출. labelled_queries 는 [(query, 정답 page url), ...].
+    vector / hybrid 의 검색 latency 와 hit@k, mrr 을 비교한다. query embedding 은 cache 로 미리 채워 둔다
+    """
+    from chats.services import RetrievalService
+
+    for retrieval_mode in ["vector", "hybrid"]:
+        retrieval_service = RetrievalService(user, retrieval_mode=retrieval_mode)
+        search_func = retrieval_service.hybrid_search if retrieval_mode == "hybrid" else retrieval_service.vector_search
+        for query, _ in labelled_queries:
+            retrieval_service.chunked_client.embed_query(query)
+
+        latencies = []
+        hit_count = 0
+        reciprocal_ranks = []
+        for query, answer_url in labelled_queries:
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                document_urls = list(search_func(query).keys())
+                latencies.append(time.perf_counter() - start_time)
+            if answer_url in document_urls:
+                hit_count += 1
+                reciprocal_ranks.append(1 / (document_urls.index(answer_url) + 1))
+            else:
+                reciprocal_ranks.append(0)
+        latencies.sort()
+        print(
+            f"[{retrieval_mode}] hit@k {hit_count / len(labelled_queries):.3f}, "
+            f"mrr {sum(reciprocal_ranks) / len(reciprocal_ranks):.3f}, "
+            f"latency p50 {latencies[len(latencies) // 2] * 1000:.0f}ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms"
+        )
@@ -0,0 +1,109 @@
+import os
+from typing import List
+from urllib.parse import urlparse
+
+import boto3
+import orjson
+import zstandard
+from django.conf import settings
+
+
+class LocalArchiveStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def read(self, key: str) -> bytes | None:
+        file_path = os.path.join(self.root, key)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def write(self, key: str, data: bytes):
+        file_path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(prefix, file_name) for file_name in sorted(os.listdir(directory))]
+
+
+class S3ArchiveStorage:
+    def __init__(self, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=settings.NOTION_ARCHIVE_S3_ENDPOINT_URL)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for response in paginator.paginate(Bucket=self.bucket, Prefix=f"{self._object_key(prefix)}/"):
+            for item in response.get("Contents", []):
+                keys.append(item["Key"][len(self.prefix) + 1:] if self.prefix else item["Key"])
+        return keys
+
+
+def get_archive_storage(archive_url: str = None):
+    archive_url = archive_url or settings.NOTION_ARCHIVE_URL
+    if not archive_url:
+        return None
+
+    parsed_url = urlparse(archive_url)
+    if parsed_url.scheme == "s3":
+        return S3ArchiveStorage(bucket=parsed_url.netloc, prefix=parsed_url.path)
+    return LocalArchiveStorage(root=parsed_url.path)
+
+
+class NotionBlockArchive:
+    """
+    notion api 로 받은 page 와 block tree 원본을 page 단위로 zstd 압축해서 보관한다.
+    parsing 로직이 바뀌면 notion 을 다시 crawling 하지 않고 보관본으로 text 를 다시 만든다
+    """
+
+    def __init__(self, user_id: int, storage=None):
+        self.user_id = user_id
+        self.storage = storage or get_archive_storage()
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return bool(settings.NOTION_ARCHIVE_URL)
+
+    def _key(self, page_id: str) -> str:
+        return f"{self.user_id}/{page_id}.json.zst"
+
+    def save(self, page: dict, block_tree: dict):
+        data = orjson.dumps({"page": page, "block_tree": block_tree})
+        self.storage.write(self._key(page["id"]), zstandard.ZstdCompressor(level=3).compress(data))
+
+    def load(self, page_id: str) -> dict | None:
+        return self.load_key(self._key(page_id))
+
+    def load_key(self, key: str) -> dict | None:
+        data = self.storage.read(key)
+        if data is None:
+            return None
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(data))
+
+    @staticmethod
+    def is_complete(archived: dict) -> bool:
+        # 하위 block 일부를 block cache 로 건너뛰던 때의 보관본에는 is_complete 가 False 로 남아 있다
+        return archived.get("is_complete", True)
+
+    def list_keys(self) -> List[str]:
+        return self.storage.list_keys(str(self.user_id))
@@ -0,0 +1,87 @@
+import hashlib
+import threading
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from sources.constants import NOTION_BLOCK_CACHE_TTL_DAYS
+from sources.models import NotionBlockCache
+
+
+class NotionBlockCacheStore:
+    """
+    (block id, subtree hash) -> 하위 block 들의 text.
+    block 의 last_edited_time 은 더 깊은 block 이 수정되어도 바뀌지 않으므로, 하위 block 전체의 (id, last_edited_time) 으로 만든
+    subtree hash 가 같을 때만 저장된 text 를 사용한다
+    """
+
+    def __init__(self, user, is_write_only: bool = False):
+        self.user = user
+        self.is_write_only = is_write_only  # full sync 는 cache 를 읽지 않고 새로 채운다
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def get_subtree_hashes(block_tree: dict, page_id: str) -> dict:
+        # {child block 을 가져온 block id: subtree hash}
+        block_id_2_subtree_hash = {}
+
+        def get_subtree_hash(block: dict) -> str:
+            child_hashes = [get_subtree_hash(child_block) for child_block in block_tree.get(block["id"], [])]
+            signature = "|".join([block["id"], block.get("last_edited_time") or "", *child_hashes])
+            subtree_hash = hashlib.sha256(signature.encode("utf-8")).hexdigest()
+            if block["id"] in block_tree:
+                block_id_2_subtree_hash[block["id"]] = subtree_hash
+            return subtree_hash
+
+        for block in block_tree.get(page_id, []):
+            get_subtree_hash(block)
+        return block_id_2_subtree_hash
+
+    def get_many(self, block_id_2_subtree_hash: dict) -> dict:
+        # {block id: text_entries}
+        if not block_id_2_subtree_hash or self.is_write_only:
+            return {}
+
+        cache_qs = NotionBlockCache.objects.filter(
+            user=self.user,
+            block_id__in=block_id_2_subtree_hash.keys(),
+            modified__gte=timezone.now() - timedelta(days=NOTION_BLOCK_CACHE_TTL_DAYS)
+        ).values_list("block_id", "subtree_hash", "text_entries")
+
+        return {
+            block_id: text_entries for block_id, subtree_hash, text_entries in cache_qs
+            if subtree_hash == block_id_2_subtree_hash[block_id]
+        }
+
+    def count(self, hit_count: int, miss_count: int):
+        with self.lock:
+            self.hit_count += hit_count
+            self.miss_count += miss_count
+
+    def set_many(self, block_id_2_cache: dict):
+        # {block id: (last_edited_time, text_entries, subtree_hash)}
+        notion_block_caches = [
+            NotionBlockCache(
+                user=self.user,
+                block_id=block_id,
+                last_edited_time=parse_datetime(last_edited_time),
+                text_entries=text_entries,
+                subtree_hash=subtree_hash
+            ) for block_id, (last_edited_time, text_entries, subtree_hash) in block_id_2_cache.items()
+            if last_edited_time
+        ]
+        if notion_block_caches:
+            NotionBlockCache.objects.bulk_create(
+                notion_block_caches,
+                update_conflicts=True,
+                unique_fields=["user", "block_id"],
+                update_fields=["last_edited_time", "text_entries", "subtree_hash", "modified"]
+            )
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total else 0
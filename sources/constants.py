@@ -1 +1,37 @@
 NOTION_PAGE_LIMIT = 500
+
+# notion api 는 integration 당 평균 3 req/s 를 허용한다
+NOTION_REQUESTS_PER_SECOND = 3
+NOTION_FETCH_CONCURRENCY = 4
+NOTION_PAGE_CONCURRENCY = 2
+NOTION_MAX_RETRIES = 3
+
+# parent block 의 last_edited_time 이 하위 block 수정을 놓칠 수 있어, 오래된 cache 는 다시 가져온다
+NOTION_BLOCK_CACHE_TTL_DAYS = 7
+
+# sync pipeline stage 별 worker 수와 stage 사이 queue 크기
+NOTION_EMBED_CONCURRENCY = 2
+NOTION_INDEX_CONCURRENCY = 1
+NOTION_PIPELINE_QUEUE_SIZE = 8
+
+# index / save stage 는 page 를 N 개 또는 M bytes 단위로 모아서 한 번에 쓴다
+NOTION_SYNC_BATCH_PAGE_COUNT = 5
+NOTION_SYNC_BATCH_BYTES = 1024 * 1024
+
+# sync job. lease 는 lambda timeout (900s) 보다 길어야 실행 중인 chunk 를 다른 worker 가 가져가지 않는다
+NOTION_SYNC_CHUNK_SIZE = 30
+NOTION_SYNC_LEASE_SECONDS = 20 * 60
+NOTION_SYNC_MAX_ATTEMPTS = 3
+
+# user 별로 sync 는 하나만 실행한다. 진행이 멈춘 run 은 이 시간이 지나면 실패로 보고 새 sync 를 허용한다
+NOTION_SYNC_OVERLAP_POLICY = 'coalesce'
+NOTION_SYNC_RUN_STALE_SECONDS = 60 * 60
+
+# sync 진행 상황 long-poll
+NOTION_PROGRESS_POLL_SECONDS = 1
+NOTION_PROGRESS_MAX_WAIT_SECONDS = 20
+INDEX_BUILD_BATCH_SIZE = 50  # postgres 에서 읽어 한 번에 index 하는 OriginalDocument 수
+INDEX_BUILD_WORKERS = 4
+INDEX_BUILD_DOCUMENTS_PER_SECOND = 20  # es 와 embedding 에 주는 부하 상한
+INDEX_BUILD_CURSOR_SIZE = 2000  # server-side cursor 로 한 번에 가져오는 row 수
+INDEX_BUILD_CATCH_UP_PASSES = 3  # 새 version 을 만드는 동안 생긴 변경을 반영하는 최대 횟수
@@ -0,0 +1,49 @@
+from typing import List, Iterable
+
+
+class NotionDiffResult:
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.unchanged = []
+
+    def __repr__(self):
+        return f"NotionDiffResult(created={len(self.created)}, updated={len(self.updated)}, unchanged={len(self.unchanged)})"
+
+
+class NotionDiff:
+    """
+    저장된 {url: text_hash} 를 한 번만 가져와서, 들어오는 page 를 url 별로 create / update / unchanged 로 나눈다.
+    page 하나당 dict 조회 한 번이므로 전체 O(n)
+    """
+
+    def __init__(self, url_2_text_hash: dict):
+        self.url_2_text_hash = url_2_text_hash
+
+    @classmethod
+    def from_user(cls, user, source: str = None):
+        document_qs = user.originaldocument_set.filter(url__isnull=False)
+        if source:
+            document_qs = document_qs.filter(source=source)
+        return cls(dict(document_qs.values_list("url", "text_hash")))
+
+    def classify(self, notion_page_schemas: Iterable) -> NotionDiffResult:
+        result = NotionDiffResult()
+        for notion_page_schema in notion_page_schemas:
+            saved_text_hash = self.url_2_text_hash.get(notion_page_schema.url)
+            if saved_text_hash is None:
+                result.created.append(notion_page_schema)
+            elif saved_text_hash != notion_page_schema.text_hash:
+                result.updated.append(notion_page_schema)
+            else:
+                result.unchanged.append(notion_page_schema)
+        return result
+
+    def apply(self, notion_page_schemas: Iterable):
+        # 저장한 뒤 호출해서, 같은 sync 안의 다음 batch 가 최신 hash 와 비교하도록 한다
+        for notion_page_schema in notion_page_schemas:
+            self.url_2_text_hash[notion_page_schema.url] = notion_page_schema.text_hash
+
+    def deleted_urls(self, current_urls: Iterable[str]) -> List[str]:
+        current_url_set = set(current_urls)
+        return [url for url in self.url_2_text_hash if url not in current_url_set]
@@ -12,3 +12,18 @@ class DataSourceEnum(CustomEnum):
 
 class NotionValidErrorEnum(CustomEnum):
     notion_page_limit = 'notion_page_limit'
+    notion_sync_running = 'notion_sync_running'
+
+
+class SyncJobStatusEnum(CustomEnum):
+    pending = 'pending'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class NotionSyncPolicyEnum(CustomEnum):
+    # 이미 sync 가 실행 중일 때 새 sync 요청을 처리하는 방법
+    reject = 'reject'
+    coalesce = 'coalesce'  # 실행 중인 sync 의 결과를 같이 사용한다
+    queue = 'queue'  # 실행 중인 sync 가 끝나면 한 번 더 실행한다
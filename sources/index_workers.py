@@ -0,0 +1,31 @@
+"""
+build_index_version 의 process pool worker.
+spawn 으로 뜬 process 는 django 가 setup 되지 않은 상태로 이 module 을 import 하므로, model 은 setup 뒤에 import 한다
+"""
+import django
+
+_builder = None
+
+
+def init_index_worker(original_index: str, chunked_index: str):
+    global _builder
+    django.setup()
+    from sources.indexes import SearchIndexBuilder
+
+    _builder = SearchIndexBuilder(original_index, chunked_index, documents_per_second=None)
+
+
+def index_document_rows(rows: list) -> dict:
+    from sources.models import OriginalDocument
+
+    hit_count = _builder.chunked_client.embedding_cache.hit_count
+    miss_count = _builder.chunked_client.embedding_cache.miss_count
+    chunk_count = _builder.chunk_count
+    _builder.index_documents([OriginalDocument(**row) for row in rows])
+    return {
+        "document_count": len(rows),
+        "chunk_count": _builder.chunk_count - chunk_count,
+        "embedding_hit_count": _builder.chunked_client.embedding_cache.hit_count - hit_count,
+        "embedding_miss_count": _builder.chunked_client.embedding_cache.miss_count - miss_count,
+        "last_document_id": rows[-1]["id"],
+    }
@@ -0,0 +1,120 @@
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import List
+
+from django.utils import timezone
+
+from cores.elastics.clients import OriginalContextClient, ChunkedContextClient
+from cores.utils import TokenBucket, split_list
+from sources.constants import INDEX_BUILD_BATCH_SIZE, INDEX_BUILD_DOCUMENTS_PER_SECOND, INDEX_BUILD_CATCH_UP_PASSES
+from sources.models import OriginalDocument
+from sources.schemas import OriginalDocumentSchema
+from sources.services import NotionService
+from users.models import User
+
+
+class SearchIndexBuilder:
+    """
+    postgres 의 OriginalDocument 로 original / chunk index 를 채운다. notion 을 다시 읽지 않는다.
+    embedding 은 EmbeddingCache 를 거치므로 model 이 같으면 openai 를 거의 호출하지 않는다
+    """
+
+    def __init__(
+            self,
+            original_index: str = None,
+            chunked_index: str = None,
+            documents_per_second: float = INDEX_BUILD_DOCUMENTS_PER_SECOND,
+            batch_size: int = INDEX_BUILD_BATCH_SIZE,
+            with_original: bool = True,
+            with_chunked: bool = True
+    ):
+        # with_original / with_chunked 가 False 인 index 는 읽지도 쓰지도 않는다
+        self.original_client = OriginalContextClient(original_index) if with_original else None
+        self.chunked_client = ChunkedContextClient(chunked_index) if with_chunked else None
+        self.batch_size = batch_size
+        # documents_per_second 가 None 이면 호출하는 쪽에서 속도를 조절한다
+        self.token_bucket = TokenBucket(
+            documents_per_second, capacity=max(batch_size, int(documents_per_second))
+        ) if documents_per_second else None
+        self.lock = threading.Lock()
+        self.document_count = 0
+        self.chunk_count = 0
+
+    @staticmethod
+    def to_original_document_schema(original_document: OriginalDocument) -> OriginalDocumentSchema:
+        return OriginalDocumentSchema(
+            user_id=original_document.user_id,
+            data_source_type=original_document.source,
+            url=original_document.url,
+            title=original_document.title,
+            text=original_document.text,
+            text_hash=original_document.text_hash
+        )
+
+    def index_documents(self, original_documents: List[OriginalDocument], delete_surplus_chunks: bool = False):
+        # delete_surplus_chunks: 이미 index 된 document 를 다시 쓸 때, 이전보다 줄어든 뒤쪽 chunk 를 지운다
+        original_document_schemas = [self.to_original_document_schema(item) for item in original_documents]
+        if not original_document_schemas:
+            return
+        if self.token_bucket:
+            self.token_bucket.acquire(len(original_document_schemas))
+        if self.original_client:
+            self.original_client.bulk_create(original_document_schemas)
+        chunked_documents = NotionService.split_documents(original_document_schemas) if self.chunked_client else []
+        if chunked_documents:
+            self.chunked_client.create_documents(chunked_documents)
+        if self.chunked_client and delete_surplus_chunks:
+            user_id_2_url_2_chunk_count = defaultdict(dict)
+            for original_document in original_documents:
+                user_id_2_url_2_chunk_count[original_document.user_id][original_document.url] = 0
+            for chunked_document in chunked_documents:
+                user_id_2_url_2_chunk_count[chunked_document.metadata["user_id"]][chunked_document.metadata["url"]] += 1
+            for user_id, url_2_chunk_count in user_id_2_url_2_chunk_count.items():
+                user = User(id=user_id)
+                saved_chunks = self.chunked_client.get_saved_chunks(user, list(url_2_chunk_count.keys()))
+                url_2_surplus_chunk_ids = self.chunked_client.get_surplus_chunk_ids(saved_chunks, url_2_chunk_count)
+                self.chunked_client.delete_chunks(
+                    user, [chunk_id for chunk_ids in url_2_surplus_chunk_ids.values() for chunk_id in chunk_ids]
+                )
+        with self.lock:
+            self.document_count += len(original_document_schemas)
+            self.chunk_count += len(chunked_documents)
+
+    def delete_documents(self, original_documents: List[OriginalDocument]):
+        user_id_2_urls = defaultdict(list)
+        for original_document in original_documents:
+            user_id_2_urls[original_document.user_id].append(original_document.url)
+        for user_id, document_urls in user_id_2_urls.items():
+            user = User(id=user_id)
+            if self.original_client:
+                self.original_client.delete_documents(user, document_urls)
+            if self.chunked_client:
+                self.chunked_client.delete_documents(user, document_urls)
+
+    def catch_up(self, started_at: datetime, max_passes: int = INDEX_BUILD_CATCH_UP_PASSES) -> datetime:
+        """
+        새 version 을 만드는 동안 sync 가 alias (이전 version) 에 쓴 변경을 새 version 에도 반영한다.
+        마지막 pass 를 시작한 시각을 돌려준다. alias 를 옮긴 뒤 그 시각부터 한 번 더 반영하면 빠지는 변경이 없다
+        """
+        for _ in range(max_passes):
+            caught_up_at = timezone.now()
+            deleted_documents = list(OriginalDocument._base_manager.filter(
+                is_delete=True, deleted_at__gte=started_at, url__isnull=False
+            ))
+            changed_documents = list(OriginalDocument.objects.filter(modified__gte=started_at, url__isnull=False))
+            if not deleted_documents and not changed_documents:
+                break
+            # 지운 뒤 다시 만든 url 이 있을 수 있어 삭제를 먼저 한다
+            if deleted_documents:
+                self.delete_documents(deleted_documents)
+            for original_documents in split_list(changed_documents, self.batch_size):
+                self.index_documents(original_documents, delete_surplus_chunks=True)
+            print(f"catch up: deleted {len(deleted_documents)}, changed {len(changed_documents)}")
+            started_at = caught_up_at
+        return started_at
+
+    def print_summary(self):
+        print(f"indexed documents: {self.document_count}개, chunks: {self.chunk_count}개")
+        if self.chunked_client:
+            self.chunked_client.embedding_cache.print_summary()
@@ -0,0 +1,277 @@
+from datetime import timedelta
+from typing import List
+
+import sentry_sdk
+from django.db import transaction, connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from cores.elastics.clients import OriginalContextClient, ChunkedContextClient
+from cores.exception import CustomException
+from sources.constants import NOTION_SYNC_CHUNK_SIZE, NOTION_SYNC_LEASE_SECONDS, NOTION_SYNC_MAX_ATTEMPTS, \
+    NOTION_SYNC_RUN_STALE_SECONDS
+from sources.enums import DataSourceEnum, SyncJobStatusEnum, NotionSyncPolicyEnum, NotionValidErrorEnum
+from sources.exceptions import NotionValidErrorDTO
+from sources.loaders.notion import NotionLoader
+from sources.models import SyncRun, SyncChunk, DataSource, SyncManifestPage
+from sources.pipelines import NotionSyncPipeline
+from sources.services import NotionSyncStatusService, NotionService, NotionValidator
+
+
+class NotionSyncJobService:
+    """
+    sync 를 SyncRun / SyncChunk 로 기록한다.
+    chunk 는 lease 를 잡은 worker 하나만 실행하고, 끝난 page 는 checkpoint 로 남겨 재시도 시 건너뛴다
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def data_source(self):
+        return DataSource.objects.get(source=DataSourceEnum.notion)
+
+    def _lock(self):
+        # (user, data source) 단위 postgres advisory lock. transaction 이 끝나면 풀린다
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [self.user.id, self.data_source.id])
+
+    def _run_qs(self):
+        return SyncRun.objects.filter(user=self.user, data_source=self.data_source)
+
+    @transaction.atomic
+    def acquire(self, policy: NotionSyncPolicyEnum, is_full: bool = False) -> tuple:
+        """
+        user 의 sync lease 를 잡는다. (sync run, 새로 시작해야 하는지) 를 돌려준다
+        """
+        self._lock()
+        self._expire_stale_run()
+
+        running_run = self._run_qs().filter(status=SyncJobStatusEnum.running).first()
+        if not running_run:
+            # 실행 중이던 sync 가 stale 로 실패 처리되었으면, 대기 중이던 sync 를 이어서 시작한다
+            queued_run = self._run_qs().filter(status=SyncJobStatusEnum.pending).first()
+            if queued_run:
+                queued_run.status = SyncJobStatusEnum.running
+                queued_run.is_full = queued_run.is_full or is_full
+                queued_run.save(update_fields=["status", "is_full", "modified"])
+                return queued_run, True
+            return self._run_qs().create(
+                user=self.user, data_source=self.data_source, is_full=is_full
+            ), True
+
+        if policy == NotionSyncPolicyEnum.reject:
+            raise CustomException(
+                NotionValidErrorDTO(
+                    error_code=NotionValidErrorEnum.notion_sync_running,
+                    status_code=409
+                )
+            )
+        if policy == NotionSyncPolicyEnum.queue:
+            # 대기 중인 sync 는 하나만 둔다
+            queued_run = self._run_qs().filter(status=SyncJobStatusEnum.pending).first()
+            if not queued_run:
+                queued_run = self._run_qs().create(
+                    user=self.user, data_source=self.data_source, is_full=is_full, status=SyncJobStatusEnum.pending
+                )
+            elif is_full and not queued_run.is_full:
+                queued_run.is_full = True
+                queued_run.save(update_fields=["is_full", "modified"])
+            return queued_run, False
+        return running_run, False
+
+    def _expire_stale_run(self):
+        stale_before = timezone.now() - timedelta(seconds=NOTION_SYNC_RUN_STALE_SECONDS)
+        running_run = self._run_qs().filter(status=SyncJobStatusEnum.running, modified__lt=stale_before).first()
+        if running_run and not running_run.syncchunk_set.filter(modified__gte=stale_before).exists():
+            self._fail_run(running_run)
+
+    @transaction.atomic
+    def promote_queued_run(self) -> SyncRun | None:
+        # 실행 중인 sync 가 끝났으면 대기 중인 sync 를 실행 상태로 바꾼다
+        self._lock()
+        if self._run_qs().filter(status=SyncJobStatusEnum.running).exists():
+            return None
+
+        queued_run = self._run_qs().filter(status=SyncJobStatusEnum.pending).first()
+        if queued_run:
+            queued_run.status = SyncJobStatusEnum.running
+            queued_run.save(update_fields=["status", "modified"])
+        return queued_run
+
+    @classmethod
+    def _fail_run(cls, sync_run: SyncRun):
+        sync_run.status = SyncJobStatusEnum.failed
+        sync_run.finished_at = timezone.now()
+        sync_run.save(update_fields=["status", "finished_at", "modified"])
+        cls.delete_manifest(sync_run)
+        # 진행 상황 조회가 실패한 sync 를 실행 중으로 보지 않도록 멈춘 상태로 바꾼다
+        NotionSyncStatusService(sync_run.user).to_stop()
+
+    @staticmethod
+    def delete_manifest(sync_run: SyncRun):
+        SyncManifestPage.objects.filter(run=sync_run).delete()
+
+    def prepare_run(self, sync_run: SyncRun) -> bool:
+        # notion 조회나 manifest 생성이 실패하면 run 을 바로 닫아서, stale 처리될 때까지 다음 sync 가 막히지 않게 한다
+        try:
+            return self._prepare_run(sync_run)
+        except Exception:
+            self._fail_run(sync_run)
+            raise
+
+    def _prepare_run(self, sync_run: SyncRun) -> bool:
+        pages = NotionLoader(self.user).get_all_page()
+
+        # page count save
+        if not NotionValidator.validate(self.user, pages):
+            self._fail_run(sync_run)
+            return False
+
+        edited_pages = pages if sync_run.is_full else NotionService(self.user).filter_edited_pages(pages)
+        NotionSyncStatusService(self.user).to_running(len(pages), len(pages) - len(edited_pages))
+        self.create_manifest(sync_run, pages, edited_pages)
+        return True
+
+    @transaction.atomic
+    def create_manifest(self, sync_run: SyncRun, pages: List[dict], edited_pages: List[dict]):
+        # 전체 page 는 manifest 로 한 번만 저장하고, chunk 는 처리할 page 의 sequence 범위만 가진다
+        url_2_sequence = {page["url"]: sequence for sequence, page in enumerate(edited_pages)}
+        SyncManifestPage.objects.bulk_create([
+            SyncManifestPage(
+                run=sync_run,
+                sequence=url_2_sequence.get(page["url"]),
+                page_id=NotionLoader.get_id(page),
+                url=NotionLoader.get_url(page),
+                last_edited_time=NotionLoader.get_last_edited_time(page),
+                page=page if page["url"] in url_2_sequence else {}
+            ) for page in pages
+        ])
+        SyncChunk.objects.bulk_create([
+            SyncChunk(
+                run=sync_run,
+                sequence=sequence,
+                start=start,
+                end=min(start + NOTION_SYNC_CHUNK_SIZE, len(edited_pages))
+            ) for sequence, start in enumerate(range(0, len(edited_pages), NOTION_SYNC_CHUNK_SIZE))
+        ])
+
+    @staticmethod
+    def active_chunk_qs():
+        return SyncChunk.objects.filter(status=SyncJobStatusEnum.running, leased_until__gte=timezone.now())
+
+    @classmethod
+    def claimable_chunk_qs(cls):
+        # 아직 실행되지 않았거나, lease 가 끝났는데 완료되지 않은 (lambda timeout, crash) chunk.
+        # notion 요청 한도는 user 단위인데 token bucket 은 process 마다 있으므로, 한 run 의 chunk 는 하나씩 실행한다
+        return SyncChunk.objects.filter(
+            Q(status=SyncJobStatusEnum.pending) |
+            Q(status=SyncJobStatusEnum.running, leased_until__lt=timezone.now()),
+            run__status=SyncJobStatusEnum.running
+        ).exclude(run_id__in=cls.active_chunk_qs().values("run_id"))
+
+    @classmethod
+    @transaction.atomic
+    def claim(cls, chunk_id: int = None) -> SyncChunk | None:
+        chunk_qs = cls.claimable_chunk_qs().select_for_update(skip_locked=True)
+        if chunk_id:
+            chunk_qs = chunk_qs.filter(id=chunk_id)
+        chunk = chunk_qs.order_by("run_id", "sequence").first()
+        if not chunk:
+            return None
+
+        # 같은 run 의 다른 chunk 를 동시에 잡지 않도록 run 을 잠근 뒤 다시 확인한다
+        SyncRun.objects.select_for_update().get(id=chunk.run_id)
+        if cls.active_chunk_qs().filter(run_id=chunk.run_id).exists():
+            return None
+
+        chunk.status = SyncJobStatusEnum.running
+        chunk.leased_until = timezone.now() + timedelta(seconds=NOTION_SYNC_LEASE_SECONDS)
+        chunk.attempt_count += 1
+        chunk.save(update_fields=["status", "leased_until", "attempt_count", "modified"])
+        return chunk
+
+    @classmethod
+    def run_chunk(cls, chunk: SyncChunk):
+        sync_run = chunk.run
+        user = sync_run.user
+        sync_status_service = NotionSyncStatusService(user)
+        manifest_page_qs = sync_run.syncmanifestpage_set.filter(sequence__gte=chunk.start, sequence__lt=chunk.end)
+        pages = [item.page for item in manifest_page_qs.filter(synced_at__isnull=True).order_by("sequence")]
+
+        def on_page(page_url: str):
+            manifest_page_qs.filter(url=page_url).update(synced_at=timezone.now())
+            SyncChunk.objects.filter(id=chunk.id).update(
+                leased_until=timezone.now() + timedelta(seconds=NOTION_SYNC_LEASE_SECONDS),
+                modified=timezone.now()
+            )
+            sync_status_service.save_current_page_count(1)
+
+        try:
+            errors = NotionSyncPipeline(user, sync_run.is_full, on_page).overall_process(pages)
+        except Exception as e:
+            errors = [e]
+        for error in errors:
+            sentry_sdk.capture_exception(error)
+
+        remaining_page_counts = manifest_page_qs.filter(synced_at__isnull=True).count()
+        if not remaining_page_counts:
+            chunk.status = SyncJobStatusEnum.done
+        elif chunk.attempt_count < NOTION_SYNC_MAX_ATTEMPTS:
+            chunk.status = SyncJobStatusEnum.pending
+        else:
+            chunk.status = SyncJobStatusEnum.failed
+            # 더 이상 재시도하지 않는 page 도 처리된 것으로 센다
+            sync_status_service.save_current_page_count(remaining_page_counts)
+        chunk.error = "\n".join(repr(error) for error in errors)
+        chunk.leased_until = None
+        chunk.finished_at = timezone.now() if chunk.status != SyncJobStatusEnum.pending else None
+        chunk.save(update_fields=["status", "error", "leased_until", "finished_at", "modified"])
+
+    @classmethod
+    def finish_run_if_completed(cls, sync_run_id: int) -> bool:
+        # 마지막 chunk 를 끝낸 worker 만 reconcile 을 실행한다
+        sync_run = cls._close_run_if_completed(sync_run_id)
+        if not sync_run:
+            return False
+
+        cls.reconcile(sync_run)
+        # manifest 는 reconcile 까지만 쓰므로, run 이 끝나면 지워서 page 수만큼 쌓이지 않게 한다
+        cls.delete_manifest(sync_run)
+        # 진행 상황을 조회할 때마다 refresh 하지 않고, sync 가 끝날 때 한 번만 한다
+        OriginalContextClient().refresh_index()
+        ChunkedContextClient().refresh_index()
+        NotionSyncStatusService(sync_run.user).to_stop()
+        return True
+
+    @staticmethod
+    def reconcile(sync_run: SyncRun) -> List[str]:
+        # manifest 에 없는 (notion 에서 삭제된) 문서를 한 번의 query 로 찾아서, 저장소마다 한 번씩 삭제한다
+        user = sync_run.user
+        document_urls = list(user.originaldocument_set.filter(
+            source=DataSourceEnum.notion,
+            url__isnull=False
+        ).exclude(
+            url__in=sync_run.syncmanifestpage_set.values("url")
+        ).values_list("url", flat=True))
+
+        if document_urls:
+            NotionService(user).delete_documents(document_urls)
+        print(f"documents_for_delete: {len(document_urls)}개")
+        return document_urls
+
+    @staticmethod
+    @transaction.atomic
+    def _close_run_if_completed(sync_run_id: int) -> SyncRun | None:
+        sync_run = SyncRun.objects.select_for_update().get(id=sync_run_id)
+        if sync_run.status != SyncJobStatusEnum.running:
+            return None
+        if sync_run.syncchunk_set.exclude(status__in=[SyncJobStatusEnum.done, SyncJobStatusEnum.failed]).exists():
+            return None
+
+        is_failed = sync_run.syncchunk_set.filter(status=SyncJobStatusEnum.failed).exists()
+        sync_run.status = SyncJobStatusEnum.failed if is_failed else SyncJobStatusEnum.done
+        sync_run.finished_at = timezone.now()
+        sync_run.save(update_fields=["status", "finished_at", "modified"])
+        return sync_run
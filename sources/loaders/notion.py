@@ -1,12 +1,20 @@
 import hashlib
 import logging
-from time import sleep
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import List
 
 import requests
-from tqdm import tqdm
+import sentry_sdk
+from django.utils.dateparse import parse_datetime
 
 from cores.enums import CustomEnum
+from cores.utils import TokenBucket
+from sources.archives import NotionBlockArchive
+from sources.caches import NotionBlockCacheStore
+from sources.constants import NOTION_REQUESTS_PER_SECOND, NOTION_FETCH_CONCURRENCY, NOTION_MAX_RETRIES
 from sources.schemas import NotionPageSchema, NotionSearchPageSchema
 
 logger = logging.getLogger(__name__)
@@ -51,6 +59,10 @@ class RichTextEnum(CustomEnum):
     MENTION = 'mention'
 
 
+class NotionFetchError(Exception):
+    pass
+
+
 def get_hash(text: str) -> str:
     return hashlib.md5(bytes(text, encoding="utf-8")).hexdigest()
 
@@ -76,13 +88,84 @@ class NotionUserLoader:
         return email
 
 
+class NotionFetcher:
+    """
+    user 별 notion api 요청 engine.
+    token bucket 으로 초당 요청 수를 맞추고, 429 응답은 Retry-After 만큼 모든 요청을 멈춘 뒤 재시도한다
+    """
+
+    def __init__(
+            self,
+            session: requests.Session,
+            requests_per_second: float = NOTION_REQUESTS_PER_SECOND,
+            max_workers: int = NOTION_FETCH_CONCURRENCY,
+            max_retries: int = NOTION_MAX_RETRIES
+    ):
+        self.session = session
+        self.bucket = TokenBucket(requests_per_second)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.throttled_count = 0
+        self.started_at = time.perf_counter()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        response = None
+        for _ in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = self.session.request(method, url, **kwargs)
+            with self.lock:
+                self.request_count += 1
+            if response.status_code != 429:
+                break
+
+            with self.lock:
+                self.throttled_count += 1
+            self.bucket.pause(float(response.headers.get("Retry-After", 1)))
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def map(self, func, items: list) -> list:
+        return list(self.executor.map(func, items))
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "requests": self.request_count,
+            "throttled": self.throttled_count,
+            "elapsed": elapsed,
+            "requests_per_second": self.request_count / elapsed if elapsed else 0,
+        }
+
+
 class NotionLoader:
-    def __init__(self, user):
+    def __init__(
+            self,
+            user,
+            use_block_cache: bool = False,
+            refresh_block_cache: bool = False,
+            use_block_archive: bool = False
+    ):
         self.user = user
         self.session = requests.Session()
         self.session.headers.update(
             {"Authorization": f"Bearer {user.notion_access_token}", "Notion-Version": "2022-06-28"}
         )
+        self.fetcher = NotionFetcher(self.session)
+        self.page_elapsed_times = []
+        self.page_id_2_fetched_at = {}  # {page id: block 을 가져오기 시작한 시각}
+        self.block_cache = NotionBlockCacheStore(user, refresh_block_cache) if use_block_cache else None
+        self.cached_text_entries = {}  # {block id: text entries}, cache 에서 가져온 하위 block text
+        self.rendered_text_entries = {}  # {block id: (last_edited_time, text entries, subtree hash)}, cache 에 저장할 text
+        self.block_id_2_subtree_hash = {}
+        self.block_archive = NotionBlockArchive(user.id) if use_block_archive and NotionBlockArchive.is_enabled() \
+            else None
         self.unsupported_block_types = [
             NotionBlockEnum.BOOKMARK,
             NotionBlockEnum.DIVIDER,
@@ -124,7 +207,7 @@ class NotionLoader:
             },
             "page_size": 50
         }
-        response = self.session.post(
+        response = self.fetcher.post(
             "https://api.notion.com/v1/search",
             json=body_params
         ).json()
@@ -149,7 +232,7 @@ class NotionLoader:
             "page_size": 100
         }
         while True:
-            response = self.session.post(
+            response = self.fetcher.post(
                 "https://api.notion.com/v1/search",
                 json=body_params,
             ).json()
@@ -170,47 +253,62 @@ class NotionLoader:
 
         return results
 
-    def overall_process(self, pages=None):
-        notion_page_schemas = []
-
-        # Get all pages content
-        for page in tqdm(pages):
-            if page["object"] == "page":
-                processed_page = self.process_page(page)
-                sleep(0.5)
-                if processed_page:
-                    notion_page_schemas.append(processed_page)
-
-        return notion_page_schemas
+    def print_fetch_summary(self):
+        stats = self.fetcher.stats()
+        page_counts = len(self.page_elapsed_times)
+        avg_elapsed = sum(self.page_elapsed_times) / page_counts if page_counts else 0
+        max_elapsed = max(self.page_elapsed_times, default=0)
+        print(
+            f"notion fetch: {page_counts} pages, {stats['requests']} requests "
+            f"({stats['throttled']} throttled) in {stats['elapsed']:.2f}s, "
+            f"{stats['requests_per_second']:.2f} req/s, "
+            f"page wall time avg {avg_elapsed:.2f}s / max {max_elapsed:.2f}s"
+        )
+        if self.block_cache:
+            print(
+                f"notion block cache: {self.block_cache.hit_count} hits, {self.block_cache.miss_count} misses "
+                f"({self.block_cache.hit_rate:.1%})"
+            )
 
-    def process_page(self, page) -> NotionPageSchema:
+    def process_page(self, page, block_tree: dict = None) -> NotionPageSchema:
+        # block_tree 가 주어지면 (보관본 재처리) notion api 를 호출하지 않는다
         title = self.get_page_title(page)
         description = self.get_page_description(page)
         page_id = self.get_id(page)
         icon = self.get_icon(page)
         is_workspace = self.is_workspace_page(page)
 
-        raw_content = ""
-        page_blocks = self.get_blocks(page_id=page["id"])
-        for block in page_blocks:
-            block_type = block.get("type")
-            if block_type not in self.supported_block_types:
-                continue
-
-            block_data = block[block_type]
-            if not block_data.get("rich_text"):
-                continue
+        if block_tree is None:
+            block_tree = self.fetch_page(page)
 
-            for rich_text_data in block_data["rich_text"]:
-                rich_text = self.process_rich_text(rich_text_data)
-                if rich_text:
-                    raw_content += f"{rich_text}\n"
+        if self.block_cache:
+            self.block_id_2_subtree_hash = NotionBlockCacheStore.get_subtree_hashes(block_tree, page["id"])
+            self.cached_text_entries = self.block_cache.get_many(self.block_id_2_subtree_hash)
+            self.block_cache.count(
+                len(self.cached_text_entries), len(self.block_id_2_subtree_hash) - len(self.cached_text_entries)
+            )
 
-            if block.get("has_children", True):
-                children_blocks = self.get_blocks(page_id=block["id"])
-                nested_content = self.process_nested_blocks(children_blocks, "\t")
-                if nested_content:
-                    raw_content += nested_content
+        text_entries = []
+        for block in block_tree[page["id"]]:
+            if block.get("type") not in self.supported_block_types:
+                continue
+            text_entries += self.process_block(block, block_tree)
+        raw_content = self.text_entries_2_text(text_entries)
+
+        if self.block_cache:
+            self.block_cache.set_many({
+                block_id: self.rendered_text_entries.pop(block_id)
+                for block_id in block_tree if block_id in self.rendered_text_entries
+            })
+            self.cached_text_entries = {}
+            self.block_id_2_subtree_hash = {}
+
+        # notion 의 last_edited_time 은 분 단위로 내림되어, 가져온 뒤 같은 분 안에 수정되면 값이 바뀌지 않는다.
+        # 그런 page 는 last_edited_time 을 남기지 않아 다음 sync 에서 다시 가져온다
+        last_edited_time = self.get_last_edited_time(page)
+        fetched_at = self.page_id_2_fetched_at.pop(page["id"], None)
+        if last_edited_time and fetched_at and fetched_at < last_edited_time + timedelta(minutes=1):
+            last_edited_time = None
 
         if title or description or raw_content:
             return NotionPageSchema(
@@ -221,12 +319,90 @@ class NotionLoader:
                 text=raw_content,
                 text_hash=get_hash(raw_content),
                 icon=icon,
-                is_workspace=is_workspace
+                is_workspace=is_workspace,
+                last_edited_time=last_edited_time
             )
 
+    def fetch_page(self, page) -> dict:
+        s = time.perf_counter()
+        self.page_id_2_fetched_at[page["id"]] = datetime.now(timezone.utc)
+        block_tree = self.get_block_tree(page_id=page["id"])
+        if self.block_archive:
+            # 보관에 실패해도 sync 는 계속한다
+            try:
+                self.block_archive.save(page, block_tree)
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+        self.page_elapsed_times.append(time.perf_counter() - s)
+        return block_tree
+
+    def get_block_tree(self, page_id: str) -> dict:
+        # {parent block id: child blocks}. 같은 depth 의 child block 들은 fetcher 로 동시에 요청한다
+        block_tree = {page_id: self.get_blocks(page_id=page_id)}
+
+        level_blocks = block_tree[page_id]
+        is_top_level = True
+        while level_blocks:
+            parent_ids = [block["id"] for block in level_blocks if self._has_text_children(block, is_top_level)]
+            children_blocks_list = self.fetcher.map(self.get_blocks, parent_ids)
+
+            level_blocks = []
+            for parent_id, children_blocks in zip(parent_ids, children_blocks_list):
+                block_tree[parent_id] = children_blocks
+                level_blocks += children_blocks
+            is_top_level = False
+
+        return block_tree
+
+    def _has_text_children(self, block: dict, is_top_level: bool) -> bool:
+        # text 로 변환되는 block 의 child 만 가져온다
+        block_type = block.get("type")
+        if is_top_level and block_type not in self.supported_block_types:
+            return False
+
+        block_data = block.get(block_type) or {}
+        return bool(block_data.get("rich_text")) and block.get("has_children", True)
+
+    def process_block(self, block: dict, block_tree: dict) -> List[tuple]:
+        # [(block 기준 상대 depth, text), ...]
+        block_type = block.get("type")
+        block_data = block.get(block_type) or {}
+        if not block_data.get("rich_text"):
+            return []
+
+        text_entries = []
+        for rich_text_data in block_data["rich_text"]:
+            rich_text = self.process_rich_text(rich_text_data)
+            if rich_text:
+                text_entries.append((0, rich_text))
+
+        block_id = block["id"]
+        if block_id in self.cached_text_entries:
+            nested_entries = self.cached_text_entries.pop(block_id)
+        elif block_id in block_tree:
+            nested_entries = self.process_nested_blocks(block_tree[block_id], block_tree)
+            self.rendered_text_entries[block_id] = (
+                block.get("last_edited_time"),
+                nested_entries,
+                self.block_id_2_subtree_hash.get(block_id, "")
+            )
+        else:
+            nested_entries = []
+
+        text_entries += [(depth + 1, text) for depth, text in nested_entries]
+        return text_entries
+
+    @staticmethod
+    def text_entries_2_text(text_entries: List[tuple]) -> str:
+        raw_content = ""
+        for depth, text in text_entries:
+            appended_str = "\t" * depth
+            raw_content += f"{appended_str}{text}\n"
+        return raw_content
+
     def get_children_blocks(self, block_id):
         try:
-            return self.session.get(f"https://api.notion.com/v1/blocks/{block_id}/children").json()["results"]
+            return self.fetcher.get(f"https://api.notion.com/v1/blocks/{block_id}/children").json()["results"]
         except Exception as e:
             logger.error(f"Error getting children for block {block_id}: {e}")
             return []
@@ -259,13 +435,13 @@ class NotionLoader:
             if start_cursor:
                 query_params = f"page_size={page_size}&start_cursor={start_cursor}"
 
+            # 일부 block 만 가져온 page 가 저장되지 않도록 실패는 page 처리 실패로 올린다
             try:
-                response = self.session.get(
+                response = self.fetcher.get(
                     f"https://api.notion.com/v1/blocks/{page_id}/children?{query_params}",
                 )
             except Exception as e:
-                print(f"Exception from get blocks of page_id {page_id}, {e}")
-                break
+                raise NotionFetchError(f"Exception from get blocks of page_id {page_id}, {e}") from e
 
             if response.status_code == 200:
                 data = response.json()
@@ -275,35 +451,21 @@ class NotionLoader:
                 else:
                     start_cursor = data["next_cursor"]
             else:
-                print(f"Exception from get blocks of page_id {page_id}, {response.json()}")
-                break
+                raise NotionFetchError(
+                    f"Exception from get blocks of page_id {page_id}, {response.status_code} {response.text}"
+                )
 
         return block_list
 
-    def process_nested_blocks(self, children_blocks, appended_str):
-        raw_content = ""
+    def process_nested_blocks(self, children_blocks, block_tree):
+        text_entries = []
 
         for child in children_blocks:
-            child_type = child.get("type")
-            child_data = child[child_type]
-
-            if not child_data.get("rich_text"):
-                continue
-
-            for rich_text_data in child_data["rich_text"]:
-                rich_text = self.process_rich_text(rich_text_data)
-                if rich_text:
-                    raw_content += f"{appended_str}{rich_text}\n"
-
-            if child_data.get("has_children", True):
-                children_blocks = self.get_blocks(page_id=child["id"])
-                nested_content = self.process_nested_blocks(children_blocks, f"{appended_str}\t")
-                if nested_content:
-                    raw_content += nested_content
-        return raw_content
+            text_entries += self.process_block(child, block_tree)
+        return text_entries
 
     def get_page(self, page_id: str):
-        response = self.session.get(
+        response = self.fetcher.get(
             f"https://api.notion.com/v1/pages/{page_id}"
         ).json()
         return response
@@ -372,6 +534,11 @@ class NotionLoader:
     def get_url(p_or_d):
         return p_or_d["url"]
 
+    @staticmethod
+    def get_last_edited_time(p_or_d):
+        last_edited_time = p_or_d.get("last_edited_time")
+        return parse_datetime(last_edited_time) if last_edited_time else None
+
     def _get_subpage_counts(self, p_or_d_id_2_info, p_or_d_id, object_type):
         child_ids = p_or_d_id_2_info[p_or_d_id]["child_ids"]
 
@@ -0,0 +1,118 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from cores.elastics.clients import OriginalContextClient, ChunkedContextClient
+from cores.utils import TokenBucket
+from sources.constants import INDEX_BUILD_WORKERS, INDEX_BUILD_DOCUMENTS_PER_SECOND, INDEX_BUILD_BATCH_SIZE, \
+    INDEX_BUILD_CURSOR_SIZE
+from sources.index_workers import init_index_worker, index_document_rows
+from sources.indexes import SearchIndexBuilder
+from sources.models import OriginalDocument, IndexBuildCheckpoint
+
+ORIGINAL_DOCUMENT_FIELDS = ["id", "user_id", "url", "title", "text", "text_hash", "source"]
+
+
+class Command(BaseCommand):
+    help = "OriginalDocument 로 original / chunk index 의 새 version 을 만들고 alias 를 옮긴다. notion 은 다시 읽지 않는다"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=INDEX_BUILD_WORKERS, help="split / embedding / index 를 하는 process 수")
+        parser.add_argument("--documents-per-second", type=float, default=INDEX_BUILD_DOCUMENTS_PER_SECOND)
+        parser.add_argument("--batch-size", type=int, default=INDEX_BUILD_BATCH_SIZE)
+        parser.add_argument("--resume", action="store_true", help="끝나지 않은 마지막 build 를 checkpoint 부터 이어서 한다")
+        parser.add_argument("--no-swap", action="store_true", help="새 version 만 만들고 alias 는 옮기지 않는다")
+        parser.add_argument(
+            "--delete-legacy-index", action="store_true",
+            help="alias 이름과 같은 예전 index 가 있으면 alias 를 옮길 때 같이 지운다"
+        )
+
+    def handle(self, *args, **options):
+        original_manager = OriginalContextClient().index_manager
+        chunked_manager = ChunkedContextClient().index_manager
+
+        checkpoint = None
+        if options["resume"]:
+            checkpoint = IndexBuildCheckpoint.objects.filter(is_finished=False).order_by("-id").first()
+        if checkpoint:
+            self.stdout.write(
+                f"resume {checkpoint.original_index}, {checkpoint.chunked_index} "
+                f"from document {checkpoint.last_document_id} ({checkpoint.document_count} done)"
+            )
+        else:
+            checkpoint = IndexBuildCheckpoint.objects.create(
+                original_index=original_manager.create_version(),
+                chunked_index=chunked_manager.create_version()
+            )
+            self.stdout.write(f"build {checkpoint.original_index}, {checkpoint.chunked_index}")
+
+        self.load(checkpoint, options)
+        builder = SearchIndexBuilder(
+            checkpoint.original_index, checkpoint.chunked_index, options["documents_per_second"], options["batch_size"]
+        )
+        caught_up_at = builder.catch_up(checkpoint.created)
+        original_manager.finish_bulk_load(checkpoint.original_index)
+        chunked_manager.finish_bulk_load(checkpoint.chunked_index)
+
+        if not options["no_swap"]:
+            for manager, index in [
+                (original_manager, checkpoint.original_index), (chunked_manager, checkpoint.chunked_index)
+            ]:
+                old_indexes = manager.swap(index, delete_legacy_index=options["delete_legacy_index"])
+                self.stdout.write(
+                    f"{manager.alias} -> {index} (이전 version {old_indexes} 는 rollback 용으로 남겨 두었습니다)"
+                )
+            # 마지막 catch up 부터 alias 를 옮기기 전까지 이전 version 에만 쓰인 변경을 반영한다
+            builder.catch_up(caught_up_at, max_passes=1)
+        builder.print_summary()
+        checkpoint.is_finished = True
+        checkpoint.save(update_fields=["is_finished", "modified"])
+
+    def load(self, checkpoint: IndexBuildCheckpoint, options):
+        """
+        server-side cursor 로 id 순서대로 읽어 batch 를 process pool 에 넘긴다.
+        앞 batch 부터 차례로 결과를 기다리므로, checkpoint 는 항상 빈틈없이 끝난 마지막 id 를 가리킨다
+        """
+        rows = OriginalDocument.objects.filter(
+            url__isnull=False, id__gt=checkpoint.last_document_id
+        ).order_by("id").values(*ORIGINAL_DOCUMENT_FIELDS).iterator(chunk_size=INDEX_BUILD_CURSOR_SIZE)
+        documents_per_second = options["documents_per_second"]
+        token_bucket = TokenBucket(documents_per_second, capacity=max(options["batch_size"], int(documents_per_second)))
+        stats = {"document_count": 0, "chunk_count": 0, "embedding_hit_count": 0, "embedding_miss_count": 0}
+
+        futures = deque()
+        with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                # fork 하면 열려 있는 cursor 의 db connection 을 자식이 공유하게 된다
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_index_worker,
+                initargs=(checkpoint.original_index, checkpoint.chunked_index)
+        ) as executor:
+            while True:
+                batch = list(islice(rows, options["batch_size"]))
+                if not batch:
+                    break
+                token_bucket.acquire(len(batch))
+                futures.append(executor.submit(index_document_rows, batch))
+                if len(futures) >= options["workers"] * 2:
+                    self.save_checkpoint(checkpoint, futures.popleft().result(), stats)
+            while futures:
+                self.save_checkpoint(checkpoint, futures.popleft().result(), stats)
+
+        self.stdout.write(
+            f"loaded documents: {stats['document_count']}개, chunks: {stats['chunk_count']}개, "
+            f"embedding cache hit {stats['embedding_hit_count']}, miss {stats['embedding_miss_count']}"
+        )
+
+    def save_checkpoint(self, checkpoint: IndexBuildCheckpoint, result: dict, stats: dict):
+        for key in stats:
+            stats[key] += result[key]
+        checkpoint.last_document_id = result["last_document_id"]
+        checkpoint.document_count = F("document_count") + result["document_count"]
+        checkpoint.save(update_fields=["last_document_id", "document_count", "modified"])
+        checkpoint.refresh_from_db(fields=["document_count"])
+        self.stdout.write(f"  documents {checkpoint.document_count}, last id {checkpoint.last_document_id}")
@@ -0,0 +1,97 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cores.elastics.clients import OriginalContextClient, ChunkedContextClient
+from sources.constants import INDEX_BUILD_DOCUMENTS_PER_SECOND, INDEX_BUILD_BATCH_SIZE
+from sources.indexes import SearchIndexBuilder
+
+# 기존 document 를 user_id 로 routing 해서 새 index version 으로 복사한다
+ROUTING_SCRIPTS = {
+    "original": "ctx._routing = String.valueOf(ctx._source.user_id)",
+    "chunked": "ctx._routing = String.valueOf(ctx._source.metadata.user_id)",
+}
+
+
+class Command(BaseCommand):
+    help = "routing 없이 저장된 es document 를 user_id routing 을 붙여 새 index version 으로 reindex 하고 alias 를 옮긴다"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index", choices=["original", "chunked", "all"], default="all")
+        parser.add_argument("--no-swap", action="store_true")
+        parser.add_argument("--delete-legacy-index", action="store_true")
+        parser.add_argument("--requests-per-second", type=float, default=-1, help="-1 이면 제한하지 않는다")
+        parser.add_argument("--poll-interval", type=float, default=10)
+        parser.add_argument("--documents-per-second", type=float, default=INDEX_BUILD_DOCUMENTS_PER_SECOND)
+        parser.add_argument("--batch-size", type=int, default=INDEX_BUILD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        targets = [
+            ("original", OriginalContextClient()),
+            ("chunked", ChunkedContextClient()),
+        ]
+        targets = [(name, client) for name, client in targets if options["index"] in (name, "all")]
+
+        # reindex 는 시작 시점의 snapshot 을 복사하므로, 그 뒤 sync 가 alias 에 쓴 변경은 catch up 으로 옮긴다
+        started_at = timezone.now()
+        name_2_dest_index = {}
+        failed_names = []
+        for name, client in targets:
+            dest_index = client.index_manager.create_version()
+            name_2_dest_index[name] = dest_index
+            if not self.reindex(client, name, dest_index, options):
+                failed_names.append(name)
+
+        # reindex 한 index 의 새 version 에만 반영한다
+        builder = SearchIndexBuilder(
+            name_2_dest_index.get("original"), name_2_dest_index.get("chunked"),
+            options["documents_per_second"], options["batch_size"],
+            with_original="original" in name_2_dest_index, with_chunked="chunked" in name_2_dest_index
+        )
+        caught_up_at = builder.catch_up(started_at)
+
+        for name, client in targets:
+            source_index = client.index
+            dest_index = name_2_dest_index[name]
+            client.index_manager.finish_bulk_load(dest_index)
+            source_count = client.search_client.count(index=source_index).body["count"]
+            dest_count = client.search_client.count(index=dest_index).body["count"]
+            self.stdout.write(f"{name} done: {source_count} -> {dest_count} documents")
+            if name in failed_names or options["no_swap"]:
+                self.stdout.write(f"  alias 는 그대로 둡니다: {dest_index}")
+                continue
+            old_indexes = client.index_manager.swap(dest_index, delete_legacy_index=options["delete_legacy_index"])
+            self.stdout.write(f"  {source_index} -> {dest_index} (이전 {old_indexes})")
+
+        if not options["no_swap"]:
+            # 마지막 catch up 부터 alias 를 옮기기 전까지 이전 version 에만 쓰인 변경을 반영한다
+            builder.catch_up(caught_up_at, max_passes=1)
+        builder.print_summary()
+
+    def reindex(self, client, name: str, dest_index: str, options) -> bool:
+        # 실패한 document 가 없으면 True
+        source_index = client.index
+        response = client.search_client.reindex(
+            source={"index": source_index},
+            dest={"index": dest_index, "op_type": "index"},
+            script={"source": ROUTING_SCRIPTS[name], "lang": "painless"},
+            requests_per_second=options["requests_per_second"],
+            slices="auto",
+            wait_for_completion=False
+        )
+        task_id = response.body["task"]
+        self.stdout.write(f"{source_index} -> {dest_index}: task {task_id}")
+
+        while True:
+            task = client.search_client.tasks.get(task_id=task_id).body
+            status = task["task"]["status"]
+            self.stdout.write(f"  {status.get('created', 0) + status.get('updated', 0)} / {status.get('total', 0)}")
+            if task["completed"]:
+                break
+            time.sleep(options["poll_interval"])
+
+        failures = task.get("response", {}).get("failures", [])
+        if failures:
+            self.stderr.write(f"  {len(failures)} failures: {failures[:3]}")
+        return not failures
@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from sources.archives import NotionBlockArchive
+from sources.diffs import NotionDiff
+from sources.enums import DataSourceEnum
+from sources.loaders.notion import NotionLoader
+from sources.services import NotionSync
+from users.models import User
+
+
+def reparse_archived_page(user, archive_key: str):
+    archived = NotionBlockArchive(user.id).load_key(archive_key)
+    # block cache 로 건너뛴 하위 block 이 빠진 보관본으로 text 를 만들면 내용이 사라지므로 건너뛴다
+    if not archived or not NotionBlockArchive.is_complete(archived):
+        return None
+    return NotionLoader(user).process_page(archived["page"], archived["block_tree"])
+
+
+class Command(BaseCommand):
+    help = "보관된 notion raw block 으로 page text 를 다시 만들고, text_hash 가 바뀐 문서만 업데이트한다"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-ids", nargs="*", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not NotionBlockArchive.is_enabled():
+            self.stderr.write("NOTION_ARCHIVE_URL is not set")
+            return
+
+        user_qs = User.objects.filter(notion_access_token__isnull=False)
+        if options["user_ids"]:
+            user_qs = user_qs.filter(id__in=options["user_ids"])
+
+        for user in user_qs:
+            archive_keys = NotionBlockArchive(user.id).list_keys()
+            if not archive_keys:
+                continue
+
+            # fork 된 process 가 db connection 을 공유하지 않도록 먼저 닫는다
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+                notion_page_schemas = [
+                    notion_page_schema for notion_page_schema in executor.map(
+                        partial(reparse_archived_page, user), archive_keys, chunksize=16
+                    ) if notion_page_schema
+                ]
+
+            if options["dry_run"]:
+                notion_diff_result = NotionDiff.from_user(user, DataSourceEnum.notion).classify(notion_page_schemas)
+                changed_counts = len(notion_diff_result.created) + len(notion_diff_result.updated)
+                self.stdout.write(
+                    f"user {user.id}: {len(notion_page_schemas)} / {len(archive_keys)} pages, {changed_counts} changed"
+                )
+            else:
+                NotionSync(user, notion_page_schemas).update_documents(notion_page_schemas)
+                self.stdout.write(f"user {user.id}: {len(notion_page_schemas)} / {len(archive_keys)} pages reparsed")
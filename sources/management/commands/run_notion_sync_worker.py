@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sources.jobs import NotionSyncJobService
+from sources.tasks import complete_sync_run, dispatch_stalled_sync_runs
+
+
+class Command(BaseCommand):
+    help = "끝나지 않은 notion sync chunk 를 lease 를 잡고 실행한다 (--dispatch 이면 run 마다 다음 chunk 를 zappa task 로 보낸다)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="실행할 chunk 가 없으면 종료한다")
+        parser.add_argument("--dispatch", action="store_true")
+        parser.add_argument("--poll-interval", type=float, default=5)
+
+    def handle(self, *args, **options):
+        if options["dispatch"]:
+            # run 마다 chunk 하나만 보낸다. 나머지는 그 chunk 가 끝난 뒤 이어서 실행된다
+            dispatched_count = dispatch_stalled_sync_runs()
+            self.stdout.write(f"{dispatched_count} runs dispatched")
+            return
+
+        while True:
+            chunk = NotionSyncJobService.claim()
+            if not chunk:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"run chunk {chunk.id} (run {chunk.run_id}, attempt {chunk.attempt_count})")
+            NotionSyncJobService.run_chunk(chunk)
+            complete_sync_run(chunk.run)
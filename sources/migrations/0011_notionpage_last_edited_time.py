@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2023-11-30 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sources', '0010_datasource_sort_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notionpage',
+            name='last_edited_time',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2023-11-30 07:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sources', '0011_notionpage_last_edited_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotionBlockCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('block_id', models.CharField(max_length=300)),
+                ('last_edited_time', models.DateTimeField()),
+                ('text_entries', models.JSONField(default=list)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notionblockcache',
+            constraint=models.UniqueConstraint(fields=('user', 'block_id'), name='unique_notion_block_cache'),
+        ),
+    ]
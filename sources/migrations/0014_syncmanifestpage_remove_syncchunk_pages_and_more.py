@@ -0,0 +1,56 @@
+# Generated by Django 4.2.3 on 2023-12-01 08:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sources', '0013_syncrun_syncchunk'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='syncchunk',
+            name='done_page_urls',
+        ),
+        migrations.RemoveField(
+            model_name='syncchunk',
+            name='pages',
+        ),
+        migrations.RemoveField(
+            model_name='syncrun',
+            name='total_page_urls',
+        ),
+        migrations.AddField(
+            model_name='syncchunk',
+            name='end',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='syncchunk',
+            name='start',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SyncManifestPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('sequence', models.IntegerField(blank=True, default=None, null=True)),
+                ('page_id', models.CharField(max_length=300)),
+                ('url', models.TextField()),
+                ('last_edited_time', models.DateTimeField(blank=True, default=None, null=True)),
+                ('page', models.JSONField(default=dict)),
+                ('synced_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sources.syncrun')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.3 on 2023-12-05 02:47
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sources', '0014_syncmanifestpage_remove_syncchunk_pages_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexBuildCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('original_index', models.CharField(max_length=200)),
+                ('chunked_index', models.CharField(max_length=200)),
+                ('last_document_id', models.BigIntegerField(default=0)),
+                ('document_count', models.IntegerField(default=0)),
+                ('is_finished', models.BooleanField(default=False)),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2023-12-06 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sources', '0015_indexbuildcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notionblockcache',
+            name='children',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.3 on 2023-12-08 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sources', '0016_notionblockcache_children'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='notionblockcache',
+            name='children',
+        ),
+        migrations.AddField(
+            model_name='notionblockcache',
+            name='subtree_hash',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -5,7 +5,7 @@ from django.db.models import Q
 from django_extensions.db.models import TimeStampedModel
 
 from cores.models import SoftDeleteModel
-from sources.enums import DataSourceEnum
+from sources.enums import DataSourceEnum, SyncJobStatusEnum
 
 
 # Create your models here.
@@ -32,7 +32,7 @@ class DataSyncStatus(TimeStampedModel, SoftDeleteModel):
     @property
     def is_running(self):
         if self.data_source.source == DataSourceEnum.notion:
-            return False if self.cur_page_count >= self.total_page_count else True
+            return False if (self.cur_page_count or 0) >= (self.total_page_count or 0) else True
         else:
             return False
 
@@ -57,8 +57,63 @@ class NotionPage(TimeStampedModel, SoftDeleteModel):
     title = models.TextField(blank=True, null=True, default=None)
     icon = models.CharField(max_length=250, null=True, default=None)
     is_workspace = models.BooleanField(default=False)
+    last_edited_time = models.DateTimeField(null=True, blank=True, default=None)
+
+
+class NotionBlockCache(TimeStampedModel):
+    # 하위 block 전체의 subtree hash 가 같으면 저장된 text 를 다시 만들지 않고 사용한다
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE)
+    block_id = models.CharField(max_length=300)
+    last_edited_time = models.DateTimeField()
+    text_entries = models.JSONField(default=list)  # [[block 기준 상대 depth, text], ...]
+    subtree_hash = models.CharField(max_length=64, default="")  # 하위 block 전체의 (id, last_edited_time) hash
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "block_id"], name="unique_notion_block_cache")
+        ]
+
+
+class SyncRun(TimeStampedModel):
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE)
+    data_source = models.ForeignKey("sources.DataSource", null=True, blank=True, default=None, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=SyncJobStatusEnum.choices(), default=SyncJobStatusEnum.running)
+    is_full = models.BooleanField(default=False)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+
+class SyncManifestPage(TimeStampedModel):
+    # sync 시점의 전체 page 목록. worker 는 run id 와 sequence 범위로 page 를 가져간다
+    run = models.ForeignKey("sources.SyncRun", on_delete=models.CASCADE)
+    sequence = models.IntegerField(null=True, blank=True, default=None)  # 수정되지 않아 처리하지 않는 page 는 None
+    page_id = models.CharField(max_length=300)
+    url = models.TextField()
+    last_edited_time = models.DateTimeField(null=True, blank=True, default=None)
+    page = models.JSONField(default=dict)
+    synced_at = models.DateTimeField(null=True, blank=True, default=None)  # checkpoint, 재시도 시 건너뛴다
+
+
+class SyncChunk(TimeStampedModel):
+    run = models.ForeignKey("sources.SyncRun", on_delete=models.CASCADE)
+    sequence = models.IntegerField(default=0)
+    start = models.IntegerField(default=0)  # SyncManifestPage.sequence 범위 [start, end)
+    end = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, choices=SyncJobStatusEnum.choices(), default=SyncJobStatusEnum.pending)
+    attempt_count = models.IntegerField(default=0)
+    leased_until = models.DateTimeField(null=True, blank=True, default=None)
+    error = models.TextField(blank=True, default="")
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
 
 
 class DataSourceUpvote(TimeStampedModel):
     user = models.ForeignKey("users.User", on_delete=models.CASCADE)
     data_source = models.ForeignKey("sources.DataSource", on_delete=models.CASCADE)
+
+
+class IndexBuildCheckpoint(TimeStampedModel):
+    # build_index_version 진행 상황. OriginalDocument 를 id 순으로 읽어 last_document_id 까지 index 를 마쳤다
+    original_index = models.CharField(max_length=200)
+    chunked_index = models.CharField(max_length=200)
+    last_document_id = models.BigIntegerField(default=0)
+    document_count = models.IntegerField(default=0)
+    is_finished = models.BooleanField(default=False)
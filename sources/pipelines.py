@@ -0,0 +1,153 @@
+from collections import defaultdict
+from typing import List
+
+from django.db import transaction
+
+from chats.services import get_num_tokens_from_text
+from cores.constants import EMBEDDING_BATCH_TOKENS
+from cores.pipelines import Pipeline, PipelineStage
+from sources.constants import NOTION_PAGE_CONCURRENCY, NOTION_EMBED_CONCURRENCY, NOTION_INDEX_CONCURRENCY, \
+    NOTION_PIPELINE_QUEUE_SIZE, NOTION_SYNC_BATCH_PAGE_COUNT, NOTION_SYNC_BATCH_BYTES
+from sources.loaders.notion import NotionLoader
+from sources.schemas import NotionPageSchema
+from sources.services import NotionSync
+
+
+class NotionSyncPipeline:
+    """
+    fetch → parse → chunk → embed → index → save
+    network 를 기다리는 stage (notion, openai, es) 들이 서로 겹쳐서 실행된다
+    """
+
+    def __init__(self, user, is_full: bool = False, on_page=None):
+        # on_page(page url) 는 page 의 chunk 와 postgres 저장이 모두 끝났거나, 더 처리할 것이 없을 때 호출된다.
+        # 중간 stage 에서 실패한 page 는 호출되지 않아 다음 시도에서 다시 처리된다
+        self.user = user
+        self.on_page = on_page
+        self.notion_loader = NotionLoader(
+            user, use_block_cache=True, refresh_block_cache=is_full, use_block_archive=True
+        )
+        self.notion_sync = NotionSync(user, [])
+        self.notion_document_service = self.notion_sync.notion_document_service
+        self.chunked_client = self.notion_sync.chunked_client
+        self.pipeline = Pipeline([
+            PipelineStage("fetch", self.fetch, NOTION_PAGE_CONCURRENCY, NOTION_PIPELINE_QUEUE_SIZE),
+            PipelineStage("parse", self.parse, 1, NOTION_PIPELINE_QUEUE_SIZE),
+            PipelineStage("chunk", self.chunk, 1, NOTION_PIPELINE_QUEUE_SIZE),
+            PipelineStage(
+                "embed", self.embed, NOTION_EMBED_CONCURRENCY, NOTION_PIPELINE_QUEUE_SIZE,
+                batch_size=NOTION_PIPELINE_QUEUE_SIZE, max_batch_weight=EMBEDDING_BATCH_TOKENS,
+                batch_weight=self.get_chunk_tokens
+            ),
+            PipelineStage(
+                "index", self.index, NOTION_INDEX_CONCURRENCY, NOTION_PIPELINE_QUEUE_SIZE,
+                batch_size=NOTION_SYNC_BATCH_PAGE_COUNT, max_batch_weight=NOTION_SYNC_BATCH_BYTES,
+                batch_weight=lambda item: self.get_text_bytes(item[0])
+            ),
+            PipelineStage(
+                "save", self.save, 1, NOTION_PIPELINE_QUEUE_SIZE,
+                batch_size=NOTION_SYNC_BATCH_PAGE_COUNT, max_batch_weight=NOTION_SYNC_BATCH_BYTES,
+                batch_weight=self.get_text_bytes
+            ),
+        ])
+
+    def overall_process(self, pages: List[dict]) -> list:
+        # 삭제는 모든 chunk 가 끝난 뒤 NotionSyncJobService.reconcile 에서 한 번만 한다
+        self.pipeline.run(page for page in pages if page["object"] == "page")
+        self.notion_loader.print_fetch_summary()
+        self.chunked_client.embedding_cache.print_summary()
+        self.chunked_client.embedding.print_summary()
+        self.pipeline.print_summary()
+        return self.pipeline.errors
+
+    def fetch(self, page: dict):
+        return [(page, self.notion_loader.fetch_page(page))]
+
+    def parse(self, item):
+        page, block_tree = item
+        notion_page_schema = self.notion_loader.process_page(page, block_tree)
+        if not notion_page_schema:
+            if self.on_page:
+                self.on_page(page["url"])
+            return []
+        return [notion_page_schema]
+
+    def chunk(self, notion_page_schema: NotionPageSchema):
+        # text 가 바뀌지 않은 page 는 chunked_documents 를 None 으로 넘겨 embed / index 를 건너뛴다
+        notion_diff_result = self.notion_sync.notion_diff.classify([notion_page_schema])
+        if notion_diff_result.unchanged:
+            return [(notion_page_schema, None, False)]
+
+        original_document_schemas = self.notion_document_service._notion_page_schemas_2_original_document_schemas(
+            [notion_page_schema]
+        )
+        chunked_documents = self.notion_document_service.split_documents(original_document_schemas)
+        return [(notion_page_schema, chunked_documents, bool(notion_diff_result.updated))]
+
+    @staticmethod
+    def get_chunk_tokens(item) -> int:
+        _, chunked_documents, _ = item
+        return sum(get_num_tokens_from_text(document.page_content) for document in chunked_documents or [])
+
+    def embed(self, items: list):
+        # 여러 page 의 chunk 를 모아 embedding 요청을 한 번에 보내고, vector 를 page 별로 다시 나눈다.
+        # 이미 저장된 page 는 바뀐 chunk 만 embedding 하고 index 한다
+        created_documents = [
+            document for _, chunked_documents, is_update in items if chunked_documents and not is_update
+            for document in chunked_documents
+        ]
+        updated_documents = [
+            document for _, chunked_documents, is_update in items if chunked_documents and is_update
+            for document in chunked_documents
+        ]
+        updated_urls = [
+            notion_page_schema.url for notion_page_schema, chunked_documents, is_update in items
+            if chunked_documents is not None and is_update
+        ]
+        documents_for_index, vectors, url_2_surplus_chunk_ids = self.chunked_client.get_changed_chunks(
+            self.user, updated_documents, updated_urls
+        )
+        documents_for_index += created_documents
+        vectors += [None] * len(created_documents)
+        vectors = self.chunked_client.embed_missing_vectors(documents_for_index, vectors)
+
+        url_2_embedded = defaultdict(lambda: ([], []))
+        for document, vector in zip(documents_for_index, vectors):
+            page_documents, page_vectors = url_2_embedded[document.metadata["url"]]
+            page_documents.append(document)
+            page_vectors.append(vector)
+        return [
+            (
+                notion_page_schema,
+                *url_2_embedded[notion_page_schema.url],
+                url_2_surplus_chunk_ids.get(notion_page_schema.url, [])
+            ) for notion_page_schema, _, _ in items
+        ]
+
+    @staticmethod
+    def get_text_bytes(notion_page_schema: NotionPageSchema) -> int:
+        return len((notion_page_schema.text or "").encode("utf-8"))
+
+    def index(self, items: list):
+        # chunk 개수가 줄어든 page 의 뒤쪽 chunk 는 같은 bulk 요청에서 id 로 지운다
+        documents_for_index, vectors, surplus_chunk_ids = [], [], []
+        for _, page_documents, page_vectors, page_surplus_chunk_ids in items:
+            documents_for_index += page_documents
+            vectors += page_vectors
+            surplus_chunk_ids += page_surplus_chunk_ids
+
+        if documents_for_index or surplus_chunk_ids:
+            self.chunked_client.add_embedded_documents(documents_for_index, vectors, surplus_chunk_ids, self.user)
+        return [notion_page_schema for notion_page_schema, *_ in items]
+
+    def save(self, notion_page_schemas: List[NotionPageSchema]):
+        # postgres 의 text_hash / last_edited_time 은 chunk 가 index 된 뒤에 batch 단위로 저장한다.
+        # 앞 stage 에서 실패하면 이전 값이 남아 있어 다음 sync 에서 다시 처리된다
+        with transaction.atomic():
+            self.notion_sync.create_documents(notion_page_schemas, with_chunked_contexts=False)
+            self.notion_sync.update_documents(notion_page_schemas, with_chunked_contexts=False)
+            self.notion_document_service.update_last_edited_times(notion_page_schemas)
+        if self.on_page:
+            for notion_page_schema in notion_page_schemas:
+                self.on_page(notion_page_schema.url)
+        return []
@@ -79,6 +79,7 @@ class NotionPageSchema(Schema):
     icon: str
     is_workspace: bool
     update_datetime: datetime | None
+    last_edited_time: datetime | None
 
 
 class NotionPagePayloadDTO(Schema):
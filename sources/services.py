@@ -1,19 +1,25 @@
+import hashlib
+import time
 from datetime import datetime
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.functional import cached_property
 
 from chats.services import get_num_tokens_from_text
-from sources.constants import NOTION_PAGE_LIMIT
+from sources.diffs import NotionDiff
+from sources.constants import NOTION_PAGE_LIMIT, NOTION_PROGRESS_POLL_SECONDS
 from sources.loaders.drives import GoogleDriveLoader
 from sources.loaders.gmails import GoogleGmailLoader
 from sources.loaders.google_calendars import GoogleCalendarLoader
-from sources.loaders.notion import NotionUserLoader
+from sources.loaders.notion import NotionUserLoader, NotionLoader
 from sources.loaders.slacks import SlackLoader
 from sources.models import DataSyncStatus, NotionPage, DataSource
 
-from typing import List
+from typing import List, Iterable
 
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -48,6 +54,13 @@ class NotionSplitter:
         ) for document in notion_chunked_schemas]
 
         docs = text_splitter.split_documents(documents)
+        # 같은 url 안에서의 순번. (user_id, url, chunk_ordinal) 로 chunk 의 es document id 를 만든다
+        # chunk_hash 가 같은 chunk 는 update 때 다시 embedding 하지 않는다
+        url_2_chunk_count = {}
+        for doc in docs:
+            doc.metadata["chunk_ordinal"] = url_2_chunk_count.get(doc.metadata["url"], 0)
+            doc.metadata["chunk_hash"] = hashlib.sha256(doc.page_content.encode()).hexdigest()
+            url_2_chunk_count[doc.metadata["url"]] = doc.metadata["chunk_ordinal"] + 1
         return docs
 
 
@@ -86,7 +99,7 @@ class NotionService:
             ) for document in notion_page_schemas
         ]
 
-    def create_documents(self, notion_page_schemas: List[NotionPageSchema]):
+    def create_documents(self, notion_page_schemas: List[NotionPageSchema], with_chunked_contexts: bool = True):
         original_document_qs_list = [OriginalDocument(
             user_id=self.user.id,
             url=page.url,
@@ -100,7 +113,8 @@ class NotionService:
 
         original_document_schemas = self._notion_page_schemas_2_original_document_schemas(notion_page_schemas)
         self.create_original_contexts(original_document_schemas)
-        self.create_chunked_contexts(original_document_schemas)
+        if with_chunked_contexts:
+            self.create_chunked_contexts(original_document_schemas)
 
         notion_page_qs_list = [
             NotionPage(
@@ -109,30 +123,58 @@ class NotionService:
                 page_id=item.page_id,
                 title=item.title,
                 icon=item.icon,
-                is_workspace=item.is_workspace
+                is_workspace=item.is_workspace,
+                last_edited_time=item.last_edited_time
             ) for item in notion_page_schemas]
         NotionPage.objects.bulk_create(notion_page_qs_list)
 
-    def update_documents(self, notion_page_schemas: List[NotionPageSchema]):
+    def update_documents(self, notion_page_schemas: List[NotionPageSchema], with_chunked_contexts: bool = True):
         url_2_notion_page_schema = self._url_2_notion_page_schema(notion_page_schemas)
         notion_document_qs = self.user.originaldocument_set.filter(url__in=url_2_notion_page_schema.keys())
+        # bulk_update 는 auto_now 를 채우지 않는다. index version 을 만드는 동안의 변경은 modified 로 찾으므로 직접 넣는다
+        modified = timezone.now()
         for notion_document in notion_document_qs:
             notion_document.title = url_2_notion_page_schema[notion_document.url].title
             notion_document.text = url_2_notion_page_schema[notion_document.url].text
             notion_document.text_hash = url_2_notion_page_schema[notion_document.url].text_hash
-        OriginalDocument.objects.bulk_update(notion_document_qs, ["title", "text", "text_hash"])
+            notion_document.modified = modified
+        OriginalDocument.objects.bulk_update(notion_document_qs, ["title", "text", "text_hash", "modified"])
 
         original_document_schemas = self._notion_page_schemas_2_original_document_schemas(notion_page_schemas)
         self.update_original_contexts(original_document_schemas)
-        self.update_chunked_contexts(original_document_schemas)
+        if with_chunked_contexts:
+            self.update_chunked_contexts(original_document_schemas)
 
-        notion_page_for_update_qs = self.user.notionpage_set.filter(url=url_2_notion_page_schema.keys()).all()
+        notion_page_for_update_qs = self.user.notionpage_set.filter(url__in=url_2_notion_page_schema.keys()).all()
         for notion_page in notion_page_for_update_qs:
             notion_page.title = url_2_notion_page_schema[notion_page.url].title
             notion_page.icon = url_2_notion_page_schema[notion_page.url].icon
             notion_page.is_workspace = url_2_notion_page_schema[notion_page.url].is_workspace
         NotionPage.objects.bulk_update(notion_page_for_update_qs, ['title', 'icon', 'is_workspace'])
 
+    def update_last_edited_times(self, notion_page_schemas: List[NotionPageSchema]):
+        # text 가 바뀌지 않은 page 도 last_edited_time 은 갱신해야 다음 sync 에서 건너뛴다
+        url_2_notion_page_schema = self._url_2_notion_page_schema(notion_page_schemas)
+        notion_page_qs = self.user.notionpage_set.filter(url__in=url_2_notion_page_schema.keys()).all()
+        for notion_page in notion_page_qs:
+            notion_page.last_edited_time = url_2_notion_page_schema[notion_page.url].last_edited_time
+        NotionPage.objects.bulk_update(notion_page_qs, ["last_edited_time"])
+
+    def filter_edited_pages(self, pages: List[dict]) -> List[dict]:
+        # 마지막 sync 이후 notion 에서 수정된 page 만 남긴다.
+        # last_edited_time 은 분 단위라서, 가져온 시각과 같은 분에 수정된 page 는 NotionLoader 가 last_edited_time 을 비워 둔다
+        url_2_last_edited_time = dict(
+            self.user.notionpage_set.filter(last_edited_time__isnull=False).values_list("url", "last_edited_time")
+        )
+
+        edited_pages = []
+        for page in pages:
+            saved_last_edited_time = url_2_last_edited_time.get(page["url"])
+            last_edited_time = NotionLoader.get_last_edited_time(page)
+            if not saved_last_edited_time or not last_edited_time or last_edited_time > saved_last_edited_time:
+                edited_pages.append(page)
+        return edited_pages
+
     def delete_documents(self, document_urls: List[str]):
         self.user.originaldocument_set.filter(url__in=document_urls).all().delete()
         self.original_client.delete_documents(self.user, document_urls)
@@ -145,86 +187,63 @@ class NotionService:
         self.original_client.delete_documents(self.user)
         self.chunked_client.delete_documents(self.user)
 
-    def create_chunked_contexts(self, original_document_schemas: List[OriginalDocumentSchema]):
+    @staticmethod
+    def split_documents(original_document_schemas: List[OriginalDocumentSchema]) -> List[Document]:
         original_document_schemas = [item for item in original_document_schemas if get_num_tokens_from_text(item.text) > 10]
-        chunked_documents = NotionSplitter.split(original_document_schemas)
+        return NotionSplitter.split(original_document_schemas)
+
+    def create_chunked_contexts(self, original_document_schemas: List[OriginalDocumentSchema]):
+        chunked_documents = self.split_documents(original_document_schemas)
 
         self.chunked_client.create_documents(chunked_documents)
 
     def update_chunked_contexts(self, original_document_schemas: List[OriginalDocumentSchema]):
-        document_urls = [document.url for document in original_document_schemas]
-        if document_urls:
-            self.chunked_client.delete_documents(self.user, document_urls)
-        self.create_chunked_contexts(original_document_schemas)
+        # 같은 id 로 덮어쓰고, 이전보다 줄어든 뒤쪽 chunk 는 같은 bulk 요청에서 id 로 지운다
+        chunked_documents = self.split_documents(original_document_schemas)
+        documents_for_index, vectors, surplus_chunk_ids = self.chunked_client.embed_changed_documents(
+            self.user, chunked_documents, [document.url for document in original_document_schemas]
+        )
+        if documents_for_index or surplus_chunk_ids:
+            self.chunked_client.add_embedded_documents(documents_for_index, vectors, surplus_chunk_ids, self.user)
 
     def create_original_contexts(self, original_document_schemas: List[OriginalDocumentSchema]):
         self.original_client.bulk_create(original_document_schemas)
 
     def update_original_contexts(self, original_document_schemas: List[OriginalDocumentSchema]):
-        document_urls = [document.url for document in original_document_schemas]
-        if document_urls:
-            self.original_client.delete_documents(self.user, document_urls)
-        self.create_original_contexts(original_document_schemas)
+        # (user_id, url) 로 만든 id 에 그대로 덮어쓰므로 삭제 후 재생성 사이에 검색되지 않는 구간이 없다
+        self.original_client.bulk_create(original_document_schemas)
 
 
 class NotionSync:
-    def __init__(self, user, notion_page_schemas: List[NotionPageSchema]):
+    def __init__(self, user, notion_page_schemas: Iterable[NotionPageSchema]):
         self.user = user
         self.notion_page_schemas = notion_page_schemas
         self.notion_document_service = NotionService(self.user)
-        self.new_document_urls = [notion_document.url for notion_document in notion_page_schemas]
-        self.new_text_hashes = [notion_document.text_hash for notion_document in notion_page_schemas]
         self.original_client = OriginalContextClient()
         self.chunked_client = ChunkedContextClient()
 
-    def overall_process(self, total_page_urls):
-        # notion text update
-        self.create_documents()
-        self.update_documents()
-        self.delete_documents(total_page_urls)
-
-    def create_documents(self):
-        documents_for_create = [
-            document for document in self.notion_page_schemas if document.url not in self.saved_document_urls
-        ]
+    def create_documents(self, notion_page_schemas: List[NotionPageSchema], with_chunked_contexts: bool = True):
+        documents_for_create = self.notion_diff.classify(notion_page_schemas).created
         if documents_for_create:
-            self.notion_document_service.create_documents(documents_for_create)
+            self.notion_document_service.create_documents(documents_for_create, with_chunked_contexts)
+            self.notion_diff.apply(documents_for_create)
         print(f"documents for create: {len(documents_for_create)}개")
         return documents_for_create
 
-    def update_documents(self):
-        existed_document_urls = list(set(self.saved_document_urls) & set(self.new_document_urls))
-        changed_text_hashes = list(set(self.new_text_hashes) - set(self.saved_text_hashes))
-
-        document_urls_for_update = list(self.user.originaldocument_set.filter(
-            url__in=existed_document_urls,
-            text_hash__in=changed_text_hashes
-        ).values_list("url", flat=True))
-
-        documents_for_update = [
-            document for document in self.notion_page_schemas if document.url in document_urls_for_update
-        ]
+    def update_documents(self, notion_page_schemas: List[NotionPageSchema], with_chunked_contexts: bool = True):
+        notion_diff_result = self.notion_diff.classify(notion_page_schemas)
+        documents_for_update = notion_diff_result.updated
         if documents_for_update:
-            self.notion_document_service.update_documents(documents_for_update)
+            self.notion_document_service.update_documents(documents_for_update, with_chunked_contexts)
+            self.notion_diff.apply(documents_for_update)
             print(f"documents for update: {len(documents_for_update)}개")
         else:
-            print(f"documents for exists: {len(existed_document_urls)}개")
+            print(f"documents for exists: {len(notion_diff_result.unchanged)}개")
         return documents_for_update
 
-    def delete_documents(self, total_page_urls: list):
-        document_urls = list(set(self.saved_document_urls) - set(total_page_urls))
-        if document_urls:
-            self.notion_document_service.delete_documents(document_urls)
-        print(f"documents_for_delete: {len(document_urls)}개")
-        return document_urls
-
-    @cached_property
-    def saved_document_urls(self):
-        return list(self.user.originaldocument_set.values_list("url", flat=True))
-
     @cached_property
-    def saved_text_hashes(self):
-        return list(self.user.originaldocument_set.values_list("text_hash", flat=True))
+    def notion_diff(self) -> NotionDiff:
+        return NotionDiff.from_user(self.user, DataSourceEnum.notion)
 
 
 class NotionSyncStatusService:
@@ -244,23 +263,39 @@ class NotionSyncStatusService:
             )
         return sync_status
 
-    @transaction.atomic
     def save_current_page_count(self, count: int):
+        # 여러 chunk 가 동시에 더하므로 read-modify-write 대신 db 에서 더한다
         sync_status = self.get_or_create_sync_status()
-        sync_status.cur_page_count = sync_status.cur_page_count + count
-        sync_status.save()
+        DataSyncStatus.objects.filter(id=sync_status.id).update(
+            cur_page_count=Coalesce(F("cur_page_count"), 0) + count
+        )
+
+    def wait_for_progress(self, cur_page_count: int | None, timeout: float) -> DataSyncStatus:
+        # long-poll. page 수가 바뀌거나 sync 가 끝나거나 timeout 이 되면 돌려준다
+        # 처음 한 번만 get_or_create 하고 (없으면 notion 을 호출한다), 그 뒤로는 row 만 다시 읽는다
+        deadline = time.monotonic() + timeout
+        sync_status = self.get_or_create_sync_status()
+        while True:
+            if sync_status.cur_page_count != cur_page_count or not sync_status.is_running:
+                return sync_status
+            if time.monotonic() >= deadline:
+                return sync_status
+            time.sleep(NOTION_PROGRESS_POLL_SECONDS)
+            sync_status = DataSyncStatus.objects.select_related("data_source").get(id=sync_status.id)
 
     @transaction.atomic
-    def to_running(self, count: int):
+    def to_running(self, count: int, cur_count: int = 0):
         sync_status = self.get_or_create_sync_status()
         sync_status.total_page_count = count
-        sync_status.cur_page_count = 0
+        sync_status.cur_page_count = cur_count
         sync_status.save()
 
     @transaction.atomic
     def to_stop(self):
+        # is_running 은 page 수로 판단하므로, 중간에 실패한 sync 도 끝난 것으로 보이도록 맞춘다
         sync_status = self.get_or_create_sync_status()
         sync_status.last_sync_datetime = datetime.now()
+        sync_status.cur_page_count = sync_status.total_page_count
         sync_status.save()
 
 
@@ -1,22 +1,90 @@
-from typing import List
-
-import sentry_sdk
 from zappa.asynchronous import task
 
-from sources.loaders.notion import NotionLoader
-from sources.services import NotionSyncStatusService, NotionSync
-from users.models import User
+from sources.enums import SyncJobStatusEnum
+from sources.jobs import NotionSyncJobService
+from sources.models import SyncRun
 
 
-@task
-def sync_notion_task(pages: List[dict], user_id: int, total_page_urls: list):
-    user = User.objects.get(id=user_id)
-    notion_document_schemas = NotionLoader(user).overall_process(pages)
+def dispatch_sync_run(sync_run: SyncRun):
+    if not dispatch_next_chunk(sync_run):
+        # 처리할 chunk 가 없으면 삭제된 page 정리만 바로 한다
+        complete_sync_run(sync_run)
+
+
+def dispatch_next_chunk(sync_run: SyncRun) -> bool:
+    """
+    run 의 chunk 는 하나씩 이어서 실행한다. 실행 중인 chunk 가 있거나 다음 chunk 를 보냈으면 True.
+    재시도를 기다리거나 lease 가 끝난 (lambda timeout, crash) chunk 도 여기서 다시 실행된다
+    """
+    if NotionSyncJobService.active_chunk_qs().filter(run=sync_run).exists():
+        return True
+
+    chunk_id = NotionSyncJobService.claimable_chunk_qs().filter(
+        run=sync_run
+    ).order_by("sequence").values_list("id", flat=True).first()
+    if not chunk_id:
+        return False
+    sync_notion_chunk_task(chunk_id)
+    return True
+
+
+def complete_sync_run(sync_run: SyncRun):
+    # 모든 chunk 가 끝났으면 run 을 닫고, 대기 중인 sync 가 있으면 시작한다
+    if NotionSyncJobService.finish_run_if_completed(sync_run.id):
+        start_queued_run(sync_run.user)
+
+
+def start_queued_run(user):
+    queued_run = NotionSyncJobService(user).promote_queued_run()
+    if queued_run:
+        start_notion_sync_task(queued_run.id)
+
 
-    notion_sync = NotionSync(user, notion_document_schemas)
+def start_sync_run(sync_run: SyncRun) -> bool:
+    # prepare 가 실패해서 run 이 닫히면 대기 중인 sync 를 이어서 시작한다
     try:
-        notion_sync.overall_process(total_page_urls)
-        NotionSyncStatusService(user).save_current_page_count(len(pages))
-    except Exception as e:
-        sentry_sdk.capture_exception(e)
-        NotionSyncStatusService(user).save_current_page_count(len(pages))
+        is_valid = NotionSyncJobService(sync_run.user).prepare_run(sync_run)
+    except Exception:
+        start_queued_run(sync_run.user)
+        raise
+    if not is_valid:
+        start_queued_run(sync_run.user)
+        return False
+    dispatch_sync_run(sync_run)
+    return True
+
+
+def dispatch_stalled_sync_runs(event=None, context=None):
+    """
+    zappa schedule 로 주기적으로 실행한다. 실행 중인 run 마다 다음 chunk 를 한 번씩 보내고, 남은 chunk 가 없으면 run 을 닫는다.
+    chunk 를 보낸 lambda 가 중간에 죽어서 이어지지 않은 run 이 여기서 다시 진행된다
+    """
+    sync_run_qs = SyncRun.objects.filter(
+        status=SyncJobStatusEnum.running,
+        syncmanifestpage__isnull=False  # manifest 를 아직 만들고 있는 run 은 건너뛴다
+    ).distinct().select_related("user")
+
+    dispatched_count = 0
+    for sync_run in sync_run_qs:
+        if dispatch_next_chunk(sync_run):
+            dispatched_count += 1
+        else:
+            complete_sync_run(sync_run)
+    print(f"stalled sync runs: {len(sync_run_qs)}개, dispatched: {dispatched_count}개")
+    return dispatched_count
+
+
+@task
+def start_notion_sync_task(sync_run_id: int):
+    start_sync_run(SyncRun.objects.get(id=sync_run_id))
+
+
+@task
+def sync_notion_chunk_task(chunk_id: int):
+    # lease 를 잡지 못하면 (다른 worker 가 실행 중이거나 이미 끝남) 아무것도 하지 않는다
+    chunk = NotionSyncJobService.claim(chunk_id)
+    if chunk:
+        NotionSyncJobService.run_chunk(chunk)
+        # 처리하지 못한 page 가 남아 pending 으로 돌아간 chunk 도 다음 chunk 로 다시 실행된다
+        if not dispatch_next_chunk(chunk.run):
+            complete_sync_run(chunk.run)
@@ -1,3 +1,98 @@
-from django.test import TestCase
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from sources.caches import NotionBlockCacheStore
+from sources.diffs import NotionDiff
+from sources.loaders.notion import NotionLoader
+
+
+def make_block(
+        block_id: str,
+        text: str = None,
+        has_children: bool = False,
+        href: str = None,
+        last_edited_time: str = "2023-12-01T00:00:00.000Z"
+) -> dict:
+    rich_text = [{"type": "text", "plain_text": text, "href": href}] if text else []
+    return {
+        "id": block_id,
+        "type": "paragraph",
+        "has_children": has_children,
+        "last_edited_time": last_edited_time,
+        "paragraph": {"rich_text": rich_text}
+    }
+
+
+class NotionLoaderProcessBlockTest(SimpleTestCase):
+    def setUp(self):
+        self.loader = NotionLoader(SimpleNamespace(id=1, notion_access_token="token"))
+        self.block_tree = {
+            "page": [make_block("a", "A", has_children=True)],
+            "a": [make_block("b", "B", has_children=True)],
+            "b": [make_block("c", "C")],
+        }
+
+    def test_nested_blocks_are_indented_by_depth(self):
+        text_entries = self.loader.process_block(self.block_tree["page"][0], self.block_tree)
+
+        self.assertEqual(text_entries, [(0, "A"), (1, "B"), (2, "C")])
+        self.assertEqual(NotionLoader.text_entries_2_text(text_entries), "A\n\tB\n\t\tC\n")
+
+    def test_links_and_empty_blocks_are_skipped(self):
+        self.assertEqual(self.loader.process_block(make_block("d", "link", href="https://a.com"), {}), [])
+        self.assertEqual(self.loader.process_block(make_block("e"), {}), [])
+
+    def test_cached_text_entries_replace_children(self):
+        self.loader.cached_text_entries = {"a": [(0, "cached")]}
+
+        text_entries = self.loader.process_block(self.block_tree["page"][0], self.block_tree)
+
+        self.assertEqual(text_entries, [(0, "A"), (1, "cached")])
+        self.assertNotIn("b", self.loader.rendered_text_entries)
+
+    def test_rendered_text_entries_keep_subtree_hash(self):
+        self.loader.block_id_2_subtree_hash = {"a": "hash-a", "b": "hash-b"}
+
+        self.loader.process_block(self.block_tree["page"][0], self.block_tree)
+
+        self.assertEqual(
+            self.loader.rendered_text_entries["a"], ("2023-12-01T00:00:00.000Z", [(0, "B"), (1, "C")], "hash-a")
+        )
+        self.assertEqual(self.loader.rendered_text_entries["b"], ("2023-12-01T00:00:00.000Z", [(0, "C")], "hash-b"))
+
+    def test_subtree_hash_changes_when_deep_block_is_edited(self):
+        block_id_2_subtree_hash = NotionBlockCacheStore.get_subtree_hashes(self.block_tree, "page")
+        self.block_tree["b"] = [make_block("c", "C2", last_edited_time="2023-12-02T00:00:00.000Z")]
+        edited_block_id_2_subtree_hash = NotionBlockCacheStore.get_subtree_hashes(self.block_tree, "page")
+
+        self.assertEqual(set(block_id_2_subtree_hash), {"a", "b"})
+        self.assertNotEqual(block_id_2_subtree_hash["a"], edited_block_id_2_subtree_hash["a"])
+        self.assertNotEqual(block_id_2_subtree_hash["b"], edited_block_id_2_subtree_hash["b"])
+
+
+class NotionDiffTest(SimpleTestCase):
+    def setUp(self):
+        self.notion_diff = NotionDiff({"https://a": "hash-a", "https://b": "hash-b"})
+
+    def test_classify_by_url_and_text_hash(self):
+        result = self.notion_diff.classify([
+            SimpleNamespace(url="https://a", text_hash="hash-a"),
+            SimpleNamespace(url="https://b", text_hash="hash-b2"),
+            SimpleNamespace(url="https://c", text_hash="hash-c"),
+        ])
+
+        self.assertEqual([item.url for item in result.created], ["https://c"])
+        self.assertEqual([item.url for item in result.updated], ["https://b"])
+        self.assertEqual([item.url for item in result.unchanged], ["https://a"])
+
+    def test_apply_updates_saved_hashes(self):
+        notion_page_schema = SimpleNamespace(url="https://b", text_hash="hash-b2")
+        self.notion_diff.apply([notion_page_schema])
+
+        result = self.notion_diff.classify([notion_page_schema])
+
+        self.assertEqual(result.unchanged, [notion_page_schema])
+
+    def test_deleted_urls(self):
+        self.assertEqual(self.notion_diff.deleted_urls(["https://a"]), ["https://b"])
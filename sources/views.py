@@ -6,27 +6,25 @@ import requests
 from django.conf import settings
 
 from cores.apis import api, api_v2
-from cores.elastics.clients import ChunkedContextClient
 from cores.enums import ApiTagEnum
 from cores.exception import CustomException
-from cores.utils import split_list_and_run
-from sources.constants import NOTION_PAGE_LIMIT
+from sources.constants import NOTION_PAGE_LIMIT, NOTION_PROGRESS_MAX_WAIT_SECONDS, NOTION_SYNC_OVERLAP_POLICY
 from sources.loaders.drives import GoogleDriveLoader
 from sources.loaders.gmails import GoogleGmailLoader
 from sources.loaders.google_calendars import GoogleCalendarLoader
 from sources.loaders.slacks import SlackLoader
 from sources.models import DataSource, DataSourceUpvote
-from sources.services import NotionService, NotionValidator, GmailSyncStatusService, GoogleDriveSyncStatusService, \
+from sources.services import NotionService, GmailSyncStatusService, GoogleDriveSyncStatusService, \
     GoogleCalendarSyncStatusService, SlackSyncStatusService
-from sources.enums import NotionValidErrorEnum, DataSourceEnum
+from sources.enums import NotionValidErrorEnum, DataSourceEnum, NotionSyncPolicyEnum, SyncJobStatusEnum
 from sources.exceptions import NotionValidErrorDTO
-from sources.loaders.notion import NotionLoader
 from sources.schemas import SyncStatusSchema, NotionPageDTO, NotionPagePayloadDTO, MyDataSourceDTO, DataSourceDTO, \
     PostUpvoteParams
 import base64
 
 from sources.services import NotionSyncStatusService
-from sources.tasks import sync_notion_task
+from sources.jobs import NotionSyncJobService
+from sources.tasks import start_sync_run, dispatch_next_chunk
 
 
 @api_v2.get(
@@ -95,34 +93,50 @@ def notion_callback(request, code: str, redirect_url: str):
 
 @api.post(
     path="source/notion/sync/",
-    response={200: None, 400: NotionValidErrorDTO},
+    response={200: None, 400: NotionValidErrorDTO, 409: NotionValidErrorDTO},
     tags=[ApiTagEnum.source]
 )
 @api_v2.post(
     path="source/notion/sync/",
-    response={200: None, 400: NotionValidErrorDTO},
+    response={200: None, 400: NotionValidErrorDTO, 409: NotionValidErrorDTO},
     tags=[ApiTagEnum.source]
 )
-def sync_notion(request):
+def sync_notion(request, is_full: bool = False, policy: NotionSyncPolicyEnum = NOTION_SYNC_OVERLAP_POLICY):
+    """
+    - is_full : false 이면 마지막 sync 이후 수정된 page 만 다시 가져오고, 수정되지 않은 block 은 cache 를 사용한다
+      (parsing 로직 변경 시 true)
+    - policy : 이미 sync 가 실행 중일 때 reject (409) / coalesce (실행 중인 sync 사용) / queue (끝난 뒤 한 번 더)
+    """
     user = request.user
 
-    notion_loader = NotionLoader(user)
-    pages = notion_loader.get_all_page()
+    sync_job_service = NotionSyncJobService(user)
+    sync_run, is_new = sync_job_service.acquire(policy, is_full)
+    if not is_new:
+        if sync_run.status == SyncJobStatusEnum.running:
+            # 실행 중인 sync 에 합쳐질 때, 멈춰 있는 chunk 가 있으면 다시 실행한다
+            dispatch_next_chunk(sync_run)
+        return
 
-    # page count save
-    is_valid = NotionValidator.validate(user, pages)
-    if not is_valid:
+    if not start_sync_run(sync_run):
         raise CustomException(
             NotionValidErrorDTO(
                 error_code=NotionValidErrorEnum.notion_page_limit
             )
         )
 
-    if pages:
-        NotionSyncStatusService(user).to_running(len(pages))
-        total_page_urls = [page["url"] for page in pages]  # for delete
 
-        split_list_and_run(pages, 30, sync_notion_task, user.id, total_page_urls)
+@api_v2.get(
+    path="source/notion/sync/progress/",
+    response={200: SyncStatusSchema},
+    description="- long-poll : current_page_count 와 값이 달라지거나 sync 가 끝나면 바로, 아니면 timeout 초 뒤에 응답한다",
+    tags=[ApiTagEnum.source]
+)
+def notion_sync_progress(request, current_page_count: int = None, timeout: int = NOTION_PROGRESS_MAX_WAIT_SECONDS):
+    user = request.user
+    sync_status = NotionSyncStatusService(user).wait_for_progress(
+        current_page_count, min(timeout, NOTION_PROGRESS_MAX_WAIT_SECONDS)
+    )
+    return SyncStatusSchema.from_instance(sync_status)
 
 
 @api.post(
@@ -288,7 +302,4 @@ def source_status(request):
     user = request.user
 
     data_sync_status_qs = user.datasyncstatus_set.all()
-    if not data_sync_status_qs.get(data_source__source=DataSourceEnum.notion).is_running:
-        ChunkedContextClient().refresh_index()
-        NotionSyncStatusService(user).to_stop()
     return SyncStatusSchema.from_instances(data_sync_status_qs)